@@ -0,0 +1,188 @@
+"""
+
+MAPF Simulator
+
+author: Justin Li (@justin871030)
+
+"""
+
+import heapq
+import itertools
+import time
+
+class AStar:
+    """
+    Space-time A* over the callbacks of a solver (CBS or PBS):
+    get_location_state, get_neighbors, admissible_heuristic and is_at_goal.
+
+    States are packed into one int (t << 32 | y << 16 | x). Every action costs
+    one timestep, so g of a state is fixed by its time and a state never needs
+    to be pushed twice: the table of generated states, keyed on the packed
+    ints, doubles as the closed set. The open list is a binary heap ordered by
+    f, then by smaller h (deeper states first), then by insertion order.
+    States later than max_time steps after the start are not expanded, so the
+    search ends even when the goal can never be reached. A search also fails
+    once the clock passes deadline, which the solvers set from their time limit,
+    or once cancelled(), when set, returns True.
+    """
+    def __init__(self, env, max_time = 1000):
+        self.env = env
+        self.max_time = max_time
+        self.deadline = None
+        self.cancelled = None
+        self.expansions = 0
+        self.last_expansions = 0
+
+    def is_stopped(self):
+        if self.deadline is not None and time.time() > self.deadline:
+            return True
+        return self.cancelled is not None and self.cancelled()
+
+    def pack(self, state):
+        return (state.time << 32) | (state.location.y << 16) | state.location.x
+
+    def search(self, agent_name):
+        start = self.env.get_location_state(agent_name)
+        start_key = self.pack(start)
+        max_time = start.time + self.max_time
+
+        states = {start_key: start}
+        came_from = {}
+        counter = itertools.count()
+
+        h = self.env.admissible_heuristic(start, agent_name)
+        open_heap = [(h, h, next(counter), start_key)]
+        expansions = 0
+
+        while open_heap:
+            _, _, _, key = heapq.heappop(open_heap)
+            current = states[key]
+            if self.env.is_at_goal(current, agent_name):
+                self.last_expansions = expansions
+                self.expansions += expansions
+                return self.reconstruct_path(states, came_from, key)
+
+            expansions += 1
+            if current.time >= max_time:
+                continue
+            if not expansions & 1023 and self.is_stopped():
+                break
+
+            g = current.time - start.time + 1
+            for neighbor in self.env.get_neighbors(current, agent_name):
+                neighbor_key = self.pack(neighbor)
+                if neighbor_key in states:
+                    continue
+                states[neighbor_key] = neighbor
+                came_from[neighbor_key] = key
+                h = self.env.admissible_heuristic(neighbor, agent_name)
+                heapq.heappush(open_heap, (g + h, h, next(counter), neighbor_key))
+
+        self.last_expansions = expansions
+        self.expansions += expansions
+        return False
+
+    def reconstruct_path(self, states, came_from, key):
+        total_path = [states[key]]
+        while key in came_from:
+            key = came_from[key]
+            total_path.append(states[key])
+        return total_path[::-1]
+
+class FocalAStar(AStar):
+    """
+    Focal search for bounded-suboptimal planning (the low level of ECBS).
+
+    Among the open states with f <= w * f_min it expands the one whose path
+    has the fewest conflicts with the other agents, counted by the solver
+    callback count_transition_conflicts(state_1, state_2, agent_name), then by
+    f. The f_min of the open list when the goal is reached is a lower bound on
+    the optimal path cost and is kept in last_lower_bound.
+    """
+    def __init__(self, env, w = 1.0, max_time = 1000):
+        AStar.__init__(self, env, max_time)
+        self.w = w
+        self.last_lower_bound = 0
+
+    def search(self, agent_name):
+        start = self.env.get_location_state(agent_name)
+        start_key = self.pack(start)
+        max_time = start.time + self.max_time
+
+        states = {start_key: start}
+        came_from = {}
+        conflicts = {start_key: 0}
+        f_scores = {}
+        closed_set = set()
+        counter = itertools.count()
+
+        h = self.env.admissible_heuristic(start, agent_name)
+        f_scores[start_key] = h
+        open_heap = [(h, start_key)] # every open state, by f
+        pending_heap = [] # open states outside the focal bound, by f
+        focal_heap = [(0, h, h, next(counter), start_key)]
+        bound = self.w * h
+        expansions = 0
+
+        while True:
+            while open_heap and open_heap[0][1] in closed_set:
+                heapq.heappop(open_heap)
+            if not open_heap:
+                break
+            f_min = open_heap[0][0]
+            if self.w * f_min > bound:
+                bound = self.w * f_min
+                while pending_heap and pending_heap[0][0] <= bound:
+                    f, h, _, key = heapq.heappop(pending_heap)
+                    heapq.heappush(focal_heap, (conflicts[key], f, h, next(counter), key))
+            if not focal_heap:
+                break
+
+            num_conflicts, _, _, _, key = heapq.heappop(focal_heap)
+            if key in closed_set or num_conflicts != conflicts[key]:
+                continue
+            current = states[key]
+            if self.env.is_at_goal(current, agent_name):
+                self.last_expansions = expansions
+                self.expansions += expansions
+                self.last_lower_bound = f_min
+                return self.reconstruct_path(states, came_from, key)
+
+            closed_set.add(key)
+            expansions += 1
+            if current.time >= max_time:
+                continue
+            if not expansions & 1023 and self.is_stopped():
+                break
+
+            g = current.time - start.time + 1
+            for neighbor in self.env.get_neighbors(current, agent_name):
+                neighbor_key = self.pack(neighbor)
+                if neighbor_key in closed_set:
+                    continue
+                neighbor_conflicts = num_conflicts + self.env.count_transition_conflicts(current, neighbor, agent_name)
+                if neighbor_key in states:
+                    # reached again by a path with fewer conflicts
+                    if neighbor_conflicts >= conflicts[neighbor_key]:
+                        continue
+                    came_from[neighbor_key] = key
+                    conflicts[neighbor_key] = neighbor_conflicts
+                    f = f_scores[neighbor_key]
+                    if f <= bound:
+                        heapq.heappush(focal_heap, (neighbor_conflicts, f, f - g, next(counter), neighbor_key))
+                    continue
+                states[neighbor_key] = neighbor
+                came_from[neighbor_key] = key
+                conflicts[neighbor_key] = neighbor_conflicts
+                h = self.env.admissible_heuristic(neighbor, agent_name)
+                f = g + h
+                f_scores[neighbor_key] = f
+                heapq.heappush(open_heap, (f, neighbor_key))
+                if f <= bound:
+                    heapq.heappush(focal_heap, (neighbor_conflicts, f, h, next(counter), neighbor_key))
+                else:
+                    heapq.heappush(pending_heap, (f, h, next(counter), neighbor_key))
+
+        self.last_expansions = expansions
+        self.expansions += expansions
+        return False
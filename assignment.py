@@ -0,0 +1,75 @@
+"""
+
+MAPF Simulator
+
+author: Justin Li (@justin871030)
+
+"""
+
+import numpy as np
+
+def linear_sum_assignment(cost):
+    """
+    Min-cost assignment of the rows of cost to its columns (Hungarian method,
+    shortest augmenting paths with potentials). With more rows than columns,
+    only as many rows as columns are assigned, and the other way round.
+
+    Every row starts on its cheapest free column, the others are added one per
+    round with the scan over the columns vectorized, so a k x n matrix takes
+    O(k * k * n) operations at most, k = min(rows, columns).
+    Returns the row indexes and their column indexes, sorted by row.
+    """
+    cost = np.asarray(cost, dtype = float)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    row_count, column_count = cost.shape
+
+    # column 0 is a virtual column that starts every augmenting path, rows are numbered from 1
+    row_potential = np.zeros(row_count + 1)
+    column_potential = np.zeros(column_count + 1)
+    column_row = np.zeros(column_count + 1, dtype = int)
+    previous_column = np.zeros(column_count + 1, dtype = int)
+
+    # start from the cheapest column of every row, while those are distinct
+    row_potential[1:] = cost.min(axis = 1)
+    assigned = np.zeros(row_count + 1, dtype = bool)
+    for row, column in enumerate(cost.argmin(axis = 1) + 1, 1):
+        if column_row[column] == 0:
+            column_row[column] = row
+            assigned[row] = True
+
+    for row in range(1, row_count + 1):
+        if assigned[row]:
+            continue
+        column_row[0] = row
+        column = 0
+        min_slack = np.full(column_count + 1, np.inf)
+        used = np.zeros(column_count + 1, dtype = bool)
+        while column_row[column] != 0:
+            used[column] = True
+            current_row = column_row[column]
+            free = ~used
+            free[0] = False
+            slack = cost[current_row - 1] - row_potential[current_row] - column_potential[1:]
+            better = free[1:] & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            previous_column[1:][better] = column
+            free_slack = np.where(free, min_slack, np.inf)
+            next_column = int(np.argmin(free_slack))
+            delta = free_slack[next_column]
+            row_potential[column_row[used]] += delta
+            column_potential[used] -= delta
+            min_slack[free] -= delta
+            column = next_column
+        # flip the assignments along the path back to the virtual column
+        while column != 0:
+            column_row[column] = column_row[previous_column[column]]
+            column = previous_column[column]
+
+    columns = np.nonzero(column_row[1:])[0]
+    rows = column_row[1:][columns] - 1
+    if transposed:
+        rows, columns = columns, rows
+    order = np.argsort(rows)
+    return rows[order], columns[order]
@@ -0,0 +1,233 @@
+"""
+
+MAPF Simulator
+
+author: Justin Li (@justin871030)
+
+"""
+
+import sys
+import time
+import io
+import contextlib
+import csv
+import json
+sys.path.insert(0, './')
+from cbs import CBS, PBS
+from cbsh import get_heuristic
+from environment import Environment, Agent, Agent_Task, Location
+from simulation import get_default_test_data
+from copy import deepcopy
+from random import Random
+
+import argparse
+
+def bench_a_star(repeat = 5):
+    # plan every robot of the default map from its parking place to every shelf
+    map_obstacle_list, station_list, shelf_list, parking_list, agent_list, order_list = get_default_test_data(order_num = 0)
+
+    env = Environment()
+    env.read_map_by_2d_list(map_obstacle_list)
+    env.set_agents(deepcopy(agent_list))
+    cbs = CBS(env)
+
+    searches = 0
+    expansions = 0
+    time_start = time.time()
+    for _ in range(repeat):
+        for agent_name, agent in env.agent_dict.items():
+            for shelf_location in shelf_list:
+                agent.assign_task(Agent_Task(shelf_location, station_list[0][0], agent.location))
+                cbs.constraint_dict = {}
+                cbs.compute_agent_solution(agent_name)
+                searches += 1
+                expansions += cbs.a_star.last_expansions
+    time_used = time.time() - time_start
+
+    print("searches: " + str(searches))
+    print("expansions: " + str(expansions))
+    print("used time: " + str(time_used) + "s")
+    print("expansions per second: " + str(expansions / time_used))
+    return expansions / time_used
+
+def get_largest_component(map_obstacle_list):
+    # free cells connected to each other, the biggest such group
+    height, width = len(map_obstacle_list), len(map_obstacle_list[0])
+    visited = set()
+    largest = []
+    for y in range(height):
+        for x in range(width):
+            if map_obstacle_list[y][x] or (x, y) in visited:
+                continue
+            component = [(x, y)]
+            visited.add((x, y))
+            for cx, cy in component:
+                for nx, ny in ((cx + 1, cy), (cx - 1, cy), (cx, cy + 1), (cx, cy - 1)):
+                    if 0 <= nx < width and 0 <= ny < height and not map_obstacle_list[ny][nx] and (nx, ny) not in visited:
+                        visited.add((nx, ny))
+                        component.append((nx, ny))
+            if len(component) > len(largest):
+                largest = component
+    return largest
+
+def make_instance(random, map_obstacle_list, agent_num):
+    # agents with distinct random starts and goals, all in one connected part of the map
+    free_cells = sorted(get_largest_component(map_obstacle_list))
+    if len(free_cells) < 2 * agent_num:
+        raise ValueError("map has " + str(len(free_cells)) + " connected free cells, " + str(agent_num) + " agents need twice as many")
+    random.shuffle(free_cells)
+    agent_list = []
+    for i in range(agent_num):
+        start, goal = free_cells[2 * i], free_cells[2 * i + 1]
+        agent_list.append(Agent("agent" + str(i), Location(*start), Location(*goal)))
+    env = Environment()
+    env.read_map_by_2d_list(map_obstacle_list)
+    env.set_agents(agent_list)
+    return env
+
+def make_random_instance(seed, width = 16, height = 16, obstacle_rate = 0.15, agent_num = 10):
+    # random obstacles
+    random = Random(seed)
+    map_obstacle_list = [[1 if random.random() < obstacle_rate else 0 for x in range(width)] for y in range(height)]
+    return make_instance(random, map_obstacle_list, agent_num)
+
+def make_warehouse_instance(seed, block_rows = 6, block_cols = 6, block_width = 5, block_height = 2, margin = 2, agent_num = 10):
+    # blocks of shelves separated by one-cell aisles, with free margins around them for stations and parking
+    width = 2 * margin + block_cols * (block_width + 1) - 1
+    height = 2 * margin + block_rows * (block_height + 1) - 1
+    map_obstacle_list = [[0] * width for y in range(height)]
+    for row in range(block_rows):
+        for col in range(block_cols):
+            for y in range(block_height):
+                for x in range(block_width):
+                    map_obstacle_list[margin + row * (block_height + 1) + y][margin + col * (block_width + 1) + x] = 1
+    return make_instance(Random(seed), map_obstacle_list, agent_num)
+
+# name -> instance generator of the suite, by seed and number of agents
+INSTANCE_FAMILIES = {
+    "random": lambda seed, agent_num: make_random_instance(seed, width = 32, height = 32, obstacle_rate = 0.2, agent_num = agent_num),
+    "warehouse": lambda seed, agent_num: make_warehouse_instance(seed, agent_num = agent_num),
+}
+
+SOLVERS = {
+    "CBS": lambda env, time_limit: CBS(env, time_limit = time_limit),
+    "PBS": lambda env, time_limit: PBS(env, time_limit = time_limit),
+}
+
+def run_instance(env, solver_name, time_limit):
+    solver = SOLVERS[solver_name](env, time_limit)
+    with contextlib.redirect_stdout(io.StringIO()):
+        plan = solver.search()
+    return {
+        "solver": solver_name,
+        "success": bool(plan),
+        # costs count the states of a path, as the solvers do
+        "sum_of_costs": sum([len(path) for path in plan.values()]) if plan else None,
+        "makespan": max([len(path) - 1 for path in plan.values()]) if plan else None,
+        **plan.stats.as_dict()
+    }
+
+def bench_suite(families = ("random", "warehouse"), agent_nums = (5, 10, 20, 50, 100, 200), seeds = 3,\
+                solvers = ("CBS", "PBS"), time_limit = 10, label = ""):
+    # every solver on the same generated instances, one result row per run
+    results = []
+    for family in families:
+        for agent_num in agent_nums:
+            for seed in range(seeds):
+                for solver_name in solvers:
+                    env = INSTANCE_FAMILIES[family](seed, agent_num)
+                    result = {"label": label, "family": family, "agents": agent_num, "seed": seed,\
+                              "width": env.dimension[0], "height": env.dimension[1]}
+                    result.update(run_instance(env, solver_name, time_limit))
+                    results.append(result)
+                    print(family + " " + str(agent_num) + " agents, seed " + str(seed) + ", " + solver_name + ": " +\
+                          ("solved" if result["success"] else "failed") + " in " + str(round(result["runtime"], 3)) + "s")
+    print_summary(results)
+    return results
+
+def print_summary(results):
+    groups = {}
+    for result in results:
+        groups.setdefault((result["family"], result["agents"], result["solver"]), []).append(result)
+    for (family, agent_num, solver_name), group in groups.items():
+        solved = [result for result in group if result["success"]]
+        line = family + " " + str(agent_num) + " agents, " + solver_name + ": success " + str(len(solved)) + "/" + str(len(group))
+        if solved:
+            line += ", mean runtime " + str(round(sum([result["runtime"] for result in solved]) / len(solved), 3)) + "s" +\
+                    ", mean sum of costs " + str(round(sum([result["sum_of_costs"] for result in solved]) / len(solved), 1))
+        print(line)
+
+def save_results(results, file_name):
+    # .csv writes one row per run, anything else JSON
+    if file_name.endswith(".csv"):
+        with open(file_name, "w", newline = "") as f:
+            writer = csv.DictWriter(f, fieldnames = list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        with open(file_name, "w") as f:
+            json.dump(results, f, indent = 2)
+
+TREE_VARIANTS = [("CBS", {"prioritize_conflicts": False, "bypass": False}),\
+                 ("CBS + cardinal", {"prioritize_conflicts": True, "bypass": False}),\
+                 ("CBS + bypass", {"prioritize_conflicts": False, "bypass": True}),\
+                 ("CBS + cardinal + bypass", {"prioritize_conflicts": True, "bypass": True})]
+
+HEURISTIC_VARIANTS = [("CBS", {"heuristic": "none"}),\
+                      ("CBSH (CG)", {"heuristic": "cg"}),\
+                      ("CBSH (WDG)", {"heuristic": "wdg"})]
+
+def bench_cbs_tree(instance_num = 20, agent_num = 10, max_nodes = 2000, variants = TREE_VARIANTS):
+    # high-level tree size of CBS variants on the same random instances
+    results = {}
+    for name, options in variants:
+        results[name] = []
+        for seed in range(instance_num):
+            solver_options = dict(options)
+            if "heuristic" in solver_options:
+                solver_options["heuristic"] = get_heuristic(solver_options["heuristic"])
+            cbs = CBS(make_random_instance(seed, agent_num = agent_num), max_nodes = max_nodes, **solver_options)
+            time_start = time.time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                plan = cbs.search()
+            cost = sum([len(path) for path in plan.values()]) if plan else None
+            results[name].append((cost, cbs.expanded_nodes, time.time() - time_start))
+
+    # compare on the instances every variant solved
+    solved = [i for i in range(instance_num) if all([results[name][i][0] is not None for name, _ in variants])]
+    print("instances solved by all variants: " + str(len(solved)) + "/" + str(instance_num))
+    for name, _ in variants:
+        nodes = sum([results[name][i][1] for i in solved])
+        cost = sum([results[name][i][0] for i in solved])
+        time_used = sum([results[name][i][2] for i in solved])
+        print(name + ": expanded nodes " + str(nodes) + ", sum of costs " + str(cost) + ", time " + str(round(time_used, 3)) + "s")
+    return results
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--repeat", type=int, default=5, help="times every agent plans to every shelf")
+  parser.add_argument("--cbs_tree", type=bool, default=False, help="True: compare CBS tree sizes on random instances")
+  parser.add_argument("--cbs_heuristics", type=bool, default=False, help="True: compare CBS high-level heuristics on random instances")
+  parser.add_argument("--suite", type=bool, default=False, help="True: run the solvers on generated random and warehouse instances")
+  parser.add_argument("--families", default="random,warehouse", help="suite: instance families, comma separated")
+  parser.add_argument("--agent_nums", default="5,10,20,50,100,200", help="suite: numbers of agents, comma separated")
+  parser.add_argument("--seeds", type=int, default=3, help="suite: instances per family and number of agents")
+  parser.add_argument("--solvers", default="CBS,PBS", help="suite: solvers, comma separated")
+  parser.add_argument("--time_limit", type=float, default=10, help="suite: max seconds of high-level search per instance")
+  parser.add_argument("--label", default="", help="suite: name of the build, stored with every result")
+  parser.add_argument("--output", default=None, help="suite: result file, .json or .csv")
+  parser.add_argument("--instance_num", type=int, default=20, help="number of random instances")
+  parser.add_argument("--agent_num", type=int, default=10, help="agents per random instance")
+  args = parser.parse_args()
+
+  if args.suite:
+    results = bench_suite(families = args.families.split(","), agent_nums = [int(n) for n in args.agent_nums.split(",")],\
+                          seeds = args.seeds, solvers = args.solvers.split(","), time_limit = args.time_limit, label = args.label)
+    if args.output:
+      save_results(results, args.output)
+  elif args.cbs_tree:
+    bench_cbs_tree(instance_num = args.instance_num, agent_num = args.agent_num)
+  elif args.cbs_heuristics:
+    bench_cbs_tree(instance_num = args.instance_num, agent_num = args.agent_num, variants = HEURISTIC_VARIANTS)
+  else:
+    bench_a_star(repeat = args.repeat)
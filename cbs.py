@@ -10,17 +10,29 @@ import sys
 sys.path.insert(0, './')
 from a_star import AStar
 from environment import State, Location
-from math import fabs
-from itertools import combinations
-from copy import deepcopy
-from random import shuffle
+from conflicts import Conflict, ConflictDetector
+from mdd import MDD, classify_conflict
+from stats import SearchStats, Plan
+import heapq
+import itertools
+import time
+from operator import itemgetter
 
 class HighLevelNode:
     def __init__(self): #depth is number of tree node
         self.solution = {}
         self.constraint_dict = {}
         self.priority_list = []
+        self.priority_dict = {} # agent -> agents with a direct higher priority
         self.cost = 0
+        self.h = 0 # admissible estimate of the cost still to add, from the high-level heuristic
+        self.h_computed = False
+        self.lower_bound = 0
+        self.agent_lower_bounds = {}
+        self.num_conflicts = 0
+        self.expanded = False # ECBS: set once the node is expanded, it stays in the open list until it comes up
+        self.depth = 0
+        self.mdds = {} # agent -> MDD of its current path cost, built on demand
 
     def __eq__(self, other):
         if not isinstance(other, type(self)): return NotImplemented
@@ -32,144 +44,326 @@ class HighLevelNode:
     def __lt__(self, other):
         return self.cost < other.cost
 
-class Conflict:
-    VERTEX = 1
-    EDGE = 2
-    def __init__(self):
-        self.time = -1
-        self.type = -1
-
-        self.agent_1 = ''
-        self.agent_2 = ''
-
-        self.location_1 = Location()
-        self.location_2 = Location()
-
-    def __str__(self):
-        return '(' + str(self.time) + ', ' + self.agent_1 + ', ' + self.agent_2 + \
-             ', '+ str(self.location_1) + ', ' + str(self.location_2) + ')'
-
-class VertexConstraint:
-    def __init__(self, time, location):
-        self.time = time
-        self.location = location
-
-    def __eq__(self, other):
-        return self.time == other.time and self.location == other.location
-    def __hash__(self):
-        return hash(str(self.time)+str(self.location))
+class VertexConstraint(tuple):
+    __slots__ = ()
+    def __new__(cls, time, location):
+        return tuple.__new__(cls, (time, location))
+    def __getnewargs__(self):
+        return (self[0], self[1])
+    time = property(itemgetter(0))
+    location = property(itemgetter(1))
     def __str__(self):
         return '(' + str(self.time) + ', '+ str(self.location) + ')'
 
-class EdgeConstraint:
-    def __init__(self, time, location_1, location_2):
-        self.time = time
-        self.location_1 = location_1
-        self.location_2 = location_2
-    def __eq__(self, other):
-        return self.time == other.time and self.location_1 == other.location_1 \
-            and self.location_2 == other.location_2
-    def __hash__(self):
-        return hash(str(self.time) + str(self.location_1) + str(self.location_2))
+class EdgeConstraint(tuple):
+    __slots__ = ()
+    def __new__(cls, time, location_1, location_2):
+        return tuple.__new__(cls, (time, location_1, location_2))
+    def __getnewargs__(self):
+        return (self[0], self[1], self[2])
+    time = property(itemgetter(0))
+    location_1 = property(itemgetter(1))
+    location_2 = property(itemgetter(2))
     def __str__(self):
         return '(' + str(self.time) + ', '+ str(self.location_1) +', '+ str(self.location_2) + ')'
 
+class ConstraintTable:
+    """
+    Constraints of one agent indexed by timestep, so the low-level search can
+    ask whether a cell or a move is allowed at a time without allocating.
+    """
+    def __init__(self):
+        self.vertex_table = {} # time -> set of blocked locations
+        self.edge_table = {} # time -> {from location: set of blocked to locations}
+        self.latest_vertex_times = {} # location -> last time it is blocked
+        self.stay_times = {} # location -> time from which it is blocked forever
+        self.latest_time = -1
+
+    def add_vertex(self, time, location):
+        self.vertex_table.setdefault(time, set()).add(location)
+        if time > self.latest_vertex_times.get(location, -1):
+            self.latest_vertex_times[location] = time
+        if time > self.latest_time:
+            self.latest_time = time
+
+    def add_edge(self, time, location_1, location_2):
+        self.edge_table.setdefault(time, {}).setdefault(location_1, set()).add(location_2)
+        if time > self.latest_time:
+            self.latest_time = time
+
+    def add_stay(self, time, location):
+        # another agent stays at location from time on
+        if time < self.stay_times.get(location, time + 1):
+            self.stay_times[location] = time
+
+    def vertex_blocked(self, time, location):
+        locations = self.vertex_table.get(time)
+        if locations is not None and location in locations:
+            return True
+        if self.stay_times:
+            stay_time = self.stay_times.get(location)
+            return stay_time is not None and time >= stay_time
+        return False
+
+    def edge_blocked(self, time, location_1, location_2):
+        edges = self.edge_table.get(time)
+        if edges is None:
+            return False
+        locations = edges.get(location_1)
+        return locations is not None and location_2 in locations
+
+    def can_stop_at(self, time, location):
+        # an agent may end its path here only if the cell is never blocked afterwards
+        return location not in self.stay_times and time > self.latest_vertex_times.get(location, -1)
+
+    def copy(self):
+        table = ConstraintTable()
+        table.vertex_table = {time: set(locations) for time, locations in self.vertex_table.items()}
+        table.edge_table = {time: {location: set(locations) for location, locations in edges.items()} \
+            for time, edges in self.edge_table.items()}
+        table.latest_vertex_times = dict(self.latest_vertex_times)
+        table.stay_times = dict(self.stay_times)
+        table.latest_time = self.latest_time
+        return table
+
 class Constraints:
     def __init__(self):
         self.vertex_constraints = set()
         self.edge_constraints = set()
+        self.table = ConstraintTable()
+
+    def add_vertex_constraint(self, constraint):
+        self.vertex_constraints.add(constraint)
+        self.table.add_vertex(constraint.time, constraint.location)
+
+    def add_edge_constraint(self, constraint):
+        self.edge_constraints.add(constraint)
+        self.table.add_edge(constraint.time, constraint.location_1, constraint.location_2)
 
     def add_constraint(self, other):
-        self.vertex_constraints |= other.vertex_constraints
-        self.edge_constraints |= other.edge_constraints
+        for constraint in other.vertex_constraints:
+            self.add_vertex_constraint(constraint)
+        for constraint in other.edge_constraints:
+            self.add_edge_constraint(constraint)
+
+    def copy(self):
+        constraints = Constraints()
+        constraints.vertex_constraints = set(self.vertex_constraints)
+        constraints.edge_constraints = set(self.edge_constraints)
+        constraints.table = self.table.copy()
+        return constraints
 
     def __str__(self):
         return "VC: " + str([str(vc) for vc in self.vertex_constraints])  + \
             "EC: " + str([str(ec) for ec in self.edge_constraints])
 
+def shift_path(path, steps, location):
+    # the rest of path once steps timesteps are executed, retimed from 0, False unless it starts at location
+    path = path[steps:] if steps < len(path) else path[-1:]
+    if path[0].location != location:
+        return False
+    return [State(state.time - path[0].time, state.location) for state in path]
+
 class CBS:
-    def __init__(self, environment):
+    def __init__(self, environment, max_nodes = None, time_limit = None, windowed = False,\
+                 prioritize_conflicts = True, bypass = True, heuristic = None, warm_start = False, hooks = None):
         self.env = environment
         self.a_star = AStar(self)
+        self.conflict_detector = ConflictDetector()
         self.constraints = Constraints()
         self.constraint_dict = {}
-        
+        # budgets of one search, None means unlimited
+        self.max_nodes = max_nodes
+        self.time_limit = time_limit
+        # rolling-horizon mode: only resolve conflicts inside the window
+        self.windowed = windowed
+        # branch on cardinal, then semi-cardinal conflicts first (ICBS)
+        self.prioritize_conflicts = prioritize_conflicts
+        # adopt a child's path instead of branching when it removes conflicts at the same cost
+        self.bypass = bypass
+        # high-level heuristic (see cbsh.py), None orders the open list by cost only
+        self.heuristic = heuristic
+        # start the root from the paths of the previous window, for the agents still on them
+        self.warm_start = warm_start
+        self.previous_solution = {}
+        self.previous_targets = {}
+        self.warm_started_paths = 0
+        self.expanded_nodes = 0
+        self.bypasses = 0
+        # low-level searches run and skipped by reusing parent paths, per search
+        self.low_level_searches = 0
+        self.avoided_low_level_searches = 0
+        # counters of the last search, also attached to its result
+        self.stats = SearchStats()
+        # event -> callback: 'generate'(node), 'expand'(node), 'low_level'(agent, path), 'solution'(plan)
+        self.hooks = hooks or {}
+
+    def push_node(self, open_list, node, counter):
+        # order by cost plus heuristic, then fewer conflicts, then deeper nodes first
+        heapq.heappush(open_list, (node.cost + node.h, node.num_conflicts, -node.depth, next(counter), node))
+
+    def budget_exhausted(self, start_time):
+        if self.max_nodes is not None and self.expanded_nodes >= self.max_nodes:
+            return True
+        if self.time_limit is not None and time.time() - start_time >= self.time_limit:
+            return True
+        return False
+
+    def call_hook(self, event, *args):
+        hook = self.hooks.get(event)
+        if hook:
+            hook(*args)
+
+    def add_open_node(self, open_list, node, counter):
+        self.push_node(open_list, node, counter)
+        self.stats.nodes_generated += 1
+        if len(open_list) > self.stats.peak_open_size:
+            self.stats.peak_open_size = len(open_list)
+        if self.hooks:
+            self.call_hook('generate', node)
+
+    def finish_search(self, start_time, solution, node = None):
+        # fill the stats of the search and wrap the plan with them
+        self.stats.runtime = time.time() - start_time
+        self.stats.nodes_expanded = self.expanded_nodes
+        self.stats.low_level_searches = self.low_level_searches
+        self.stats.low_level_expansions = self.a_star.expansions - self.stats.low_level_expansions
+        if node is not None:
+            self.stats.constraints = sum([len(constraints.vertex_constraints) + len(constraints.edge_constraints)\
+                                          for constraints in node.constraint_dict.values()])
+        plan = Plan(self.generate_plan(solution), self.stats)
+        if self.hooks:
+            self.call_hook('solution', plan)
+        return plan
+
     def search(self):
         
-        open_set = set()
-        closed_set = set()
+        start_time = time.time()
+        self.a_star.deadline = None if self.time_limit is None else start_time + self.time_limit
+        self.expanded_nodes = 0
+        self.bypasses = 0
+        self.low_level_searches = 0
+        self.avoided_low_level_searches = 0
+        self.stats = SearchStats()
+        # expansions of this search, counted from the running total of AStar
+        self.stats.low_level_expansions = self.a_star.expansions
+        open_list = []
+        counter = itertools.count()
         start = HighLevelNode()
         # TODO: Initialize it in a better way
         start.constraint_dict = {}
         for agent in self.env.agent_dict.keys():
             start.constraint_dict[agent] = Constraints()
-        start.solution = self.compute_solution()
+        self.constraint_dict = start.constraint_dict
+        self.warm_started_paths = 0
+        start.solution = self.compute_solution(self.get_warm_start_solution())
         
         #self.print_solution(start.solution)
         
         if not start.solution:
-            return {}
+            return self.finish_search(start_time, {})
         start.cost = self.compute_solution_cost(start.solution)
-
-        open_set |= {start}
-
-        while open_set:
-            P = min(open_set)
-            open_set -= {P}
-            closed_set |= {P}
+        start.num_conflicts = self.count_conflicts(start.solution)
+        if self.heuristic is not None:
+            self.heuristic.reset()
+            start.h = self.compute_heuristic(start)
+            start.h_computed = True
+
+        self.add_open_node(open_list, start, counter)
+
+        while open_list:
+            if self.budget_exhausted(start_time):
+                print("search budget exhausted after " + str(self.expanded_nodes) + " nodes")
+                break
+            P = heapq.heappop(open_list)[-1]
+            if self.heuristic is not None and not P.h_computed:
+                # heuristics are computed when a node is first popped, most nodes never are
+                h = self.compute_heuristic(P)
+                P.h_computed = True
+                if h > P.h:
+                    P.h = h
+                    self.push_node(open_list, P, counter)
+                    continue
+            self.expanded_nodes += 1
+            if self.hooks:
+                self.call_hook('expand', P)
 
             self.constraint_dict = P.constraint_dict
-            conflict_dict = self.get_first_conflict(P.solution)
+            conflict_dict = self.choose_conflict(P)
             if not conflict_dict:
                 print("solution found")
+                print("low-level searches: " + str(self.low_level_searches) + \
+                    ", avoided: " + str(self.avoided_low_level_searches))
                 
+                self.remember_solution(P.solution)
                 self.update_path_list(P.solution)
 
-                return self.generate_plan(P.solution)
+                return self.finish_search(start_time, P.solution, P)
 
             constraint_dict = self.create_constraints_from_conflict(conflict_dict)
 
+            children = []
             for agent in constraint_dict.keys():
-                new_node = deepcopy(P)
+                # the child inherits every path but the newly constrained agent's
+                new_node = HighLevelNode()
+                new_node.depth = P.depth + 1
+                new_node.constraint_dict = dict(P.constraint_dict)
+                new_node.constraint_dict[agent] = P.constraint_dict[agent].copy()
                 new_node.constraint_dict[agent].add_constraint(constraint_dict[agent])
+                children.append((agent, new_node))
+
+            local_solutions = self.compute_agent_solutions([(agent, new_node.constraint_dict) for agent, new_node in children])
 
-                self.constraint_dict = new_node.constraint_dict
-                new_node.solution = self.compute_solution()
-                if not new_node.solution:
+            new_nodes = []
+            for (agent, new_node), local_solution in zip(children, local_solutions):
+                self.avoided_low_level_searches += len(P.solution) - 1
+                if not local_solution:
                     continue
+                new_node.solution = dict(P.solution)
+                new_node.solution[agent] = local_solution
                 new_node.cost = self.compute_solution_cost(new_node.solution)
-
-                # TODO: ending condition
-                if new_node not in closed_set:
-                    open_set |= {new_node}
+                new_node.num_conflicts = self.count_conflicts(new_node.solution)
+                new_node.mdds = dict(P.mdds)
+                new_node.mdds.pop(agent, None)
+
+                if self.bypass and new_node.cost == P.cost and new_node.num_conflicts < P.num_conflicts:
+                    # the new path also satisfies the parent's constraints and keeps its MDD
+                    P.solution = new_node.solution
+                    P.num_conflicts = new_node.num_conflicts
+                    new_nodes = [P]
+                    self.bypasses += 1
+                    break
+                new_nodes.append(new_node)
+
+            for new_node in new_nodes:
+                if new_node is not P:
+                    # the parent's estimate, less the cost already added, still holds (pathmax)
+                    new_node.h = max(0, P.cost + P.h - new_node.cost)
+                    self.add_open_node(open_list, new_node, counter)
+                else:
+                    self.push_node(open_list, new_node, counter)
         for agent in self.env.agent_dict.values():
             print(agent.location,agent.target)
 
-        return {}
+        return self.finish_search(start_time, {})
     
     def get_neighbors(self, state, agent_name):
         neighbors = []
-
-        # Wait action
-        n = State(state.time + 1, state.location)
-        if self.state_valid(n, agent_name):
-            neighbors.append(n)
-        # Up action
-        n = State(state.time + 1, Location(state.location.x, state.location.y+1))
-        if self.state_valid(n, agent_name) and self.transition_valid(state, n):
-            neighbors.append(n)
-        # Down action
-        n = State(state.time + 1, Location(state.location.x, state.location.y-1))
-        if self.state_valid(n, agent_name) and self.transition_valid(state, n):
-            neighbors.append(n)
-        # Left action
-        n = State(state.time + 1, Location(state.location.x-1, state.location.y))
-        if self.state_valid(n, agent_name) and self.transition_valid(state, n):
-            neighbors.append(n)
-        # Right action
-        n = State(state.time + 1, Location(state.location.x+1, state.location.y))
-        if self.state_valid(n, agent_name) and self.transition_valid(state, n):
-            neighbors.append(n)
+        locations = self.env.locations
+        location = state.location
+        cell = location.y * self.env.dimension[0] + location.x
+        time = state.time + 1
+
+        # Wait, up, down, left and right actions that stay on the map
+        for next_cell in self.env.neighbor_table[cell]:
+            if next_cell == cell:
+                n = State(time, location)
+                if self.state_valid(n, agent_name):
+                    neighbors.append(n)
+                continue
+            n = State(time, locations[next_cell])
+            if self.state_valid(n, agent_name) and self.transition_valid(state, n):
+                neighbors.append(n)
         return neighbors
     
     def state_wait(self, state):
@@ -177,44 +371,63 @@ class CBS:
 
 
     def get_first_conflict(self, solution):
-        #print(solution['agent1'])
-        max_t = max([len(plan) for plan in solution.values()])
-        result = Conflict()
-        for t in range(max_t):
-            for agent_1, agent_2 in combinations(solution.keys(), 2):
-                state_1 = self.get_state(agent_1, solution, t)
-                state_2 = self.get_state(agent_2, solution, t)
-                if state_1.is_equal_except_time(state_2):
-                    result.time = t
-                    result.type = Conflict.VERTEX
-                    result.location_1 = state_1.location
-                    result.agent_1 = agent_1
-                    result.agent_2 = agent_2
-                    return result
-
-            for agent_1, agent_2 in combinations(solution.keys(), 2):
-                state_1a = self.get_state(agent_1, solution, t)
-                state_1b = self.get_state(agent_1, solution, t+1)
-
-                state_2a = self.get_state(agent_2, solution, t)
-                state_2b = self.get_state(agent_2, solution, t+1)
-
-                if state_1a.is_equal_except_time(state_2b) and state_1b.is_equal_except_time(state_2a):
-                    result.time = t
-                    result.type = Conflict.EDGE
-                    result.agent_1 = agent_1
-                    result.agent_2 = agent_2
-                    result.location_1 = state_1a.location
-                    result.location_2 = state_1b.location
-                    return result
-        return False
+        time_start = time.perf_counter()
+        conflict = self.conflict_detector.get_first_conflict(solution, self.get_conflict_horizon())
+        self.stats.conflict_time += time.perf_counter() - time_start
+        return conflict
+
+    def choose_conflict(self, node):
+        if not self.prioritize_conflicts:
+            return self.get_first_conflict(node.solution)
+        time_start = time.perf_counter()
+        conflicts = self.conflict_detector.get_all_conflicts(node.solution, self.get_conflict_horizon())
+        self.stats.conflict_time += time.perf_counter() - time_start
+        if not conflicts:
+            return False
+        best_conflict = conflicts[0]
+        best_cardinality = Conflict.NON_CARDINAL
+        for conflict in conflicts:
+            cardinality = classify_conflict(conflict, self.get_mdd(node, conflict.agent_1), self.get_mdd(node, conflict.agent_2))
+            if cardinality > best_cardinality:
+                best_conflict = conflict
+                best_cardinality = cardinality
+            if cardinality == Conflict.CARDINAL:
+                break
+        return best_conflict
+
+    def compute_heuristic(self, node):
+        if not node.num_conflicts:
+            return 0
+        constraint_dict = self.constraint_dict
+        h = self.heuristic.compute(self, node)
+        self.constraint_dict = constraint_dict
+        return h
+
+    def get_mdd(self, node, agent):
+        if agent not in node.mdds:
+            self.constraints = node.constraint_dict[agent]
+            node.mdds[agent] = MDD(self, agent, len(node.solution[agent]) - 1)
+        return node.mdds[agent]
+
+    def get_conflict_horizon(self):
+        # the executed part of a plan must always be conflict-free,
+        # so the window never ends before the next replanning
+        if not self.windowed:
+            return None
+        return max(self.env.window_size, self.env.time_step_per_planning)
+
+    def count_conflicts(self, solution):
+        time_start = time.perf_counter()
+        count = self.conflict_detector.count_conflicts(solution, self.get_conflict_horizon())
+        self.stats.conflict_time += time.perf_counter() - time_start
+        return count
 
     def create_constraints_from_conflict(self, conflict):
         constraint_dict = {}
         if conflict.type == Conflict.VERTEX:
             v_constraint = VertexConstraint(conflict.time, conflict.location_1)
             constraint = Constraints()
-            constraint.vertex_constraints |= {v_constraint}
+            constraint.add_vertex_constraint(v_constraint)
             constraint_dict[conflict.agent_1] = constraint
             constraint_dict[conflict.agent_2] = constraint
 
@@ -225,8 +438,8 @@ class CBS:
             e_constraint1 = EdgeConstraint(conflict.time, conflict.location_1, conflict.location_2)
             e_constraint2 = EdgeConstraint(conflict.time, conflict.location_2, conflict.location_1)
 
-            constraint1.edge_constraints |= {e_constraint1}
-            constraint2.edge_constraints |= {e_constraint2}
+            constraint1.add_edge_constraint(e_constraint1)
+            constraint2.add_edge_constraint(e_constraint2)
 
             constraint_dict[conflict.agent_1] = constraint1
             constraint_dict[conflict.agent_2] = constraint2
@@ -240,47 +453,97 @@ class CBS:
             return solution[agent_name][-1]
 
     def state_valid(self, state, agent_name):
-        if(self.env.agent_dict[agent_name].is_idle()):
-            if State(0, self.env.agent_dict[agent_name].location).is_equal_except_time(state):
+        agent = self.env.agent_dict[agent_name]
+        location = state.location
+        if self.constraints.table.vertex_blocked(state.time, location):
+            return False
+        # the agent may enter the obstacles it starts from or has to visit
+        if(agent.is_idle()):
+            if location == agent.location:
                 return True
         else:
-            if State(0, self.env.agent_dict[agent_name].task.shelf_location).is_equal_except_time(state):
+            if location == agent.task.shelf_location:
                 return True
-            if State(0, self.env.agent_dict[agent_name].task.parking_location).is_equal_except_time(state):
+            if location == agent.task.parking_location:
                 return True
-            if State(0, self.env.agent_dict[agent_name].task.station_location).is_equal_except_time(state):
+            if location == agent.task.station_location:
                 return True
-        return state.location.x >= 0 and state.location.x < self.env.dimension[0] \
-            and state.location.y >= 0 and state.location.y < self.env.dimension[1] \
-            and VertexConstraint(state.time, state.location) not in self.constraints.vertex_constraints \
-            and (state.location.x, state.location.y) not in self.env.obstacles
+        # bounds are guaranteed by the neighbor table
+        return not self.env.grid[location.y * self.env.dimension[0] + location.x]
 
     def transition_valid(self, state_1, state_2):
-        return EdgeConstraint(state_1.time, state_1.location, state_2.location) not in self.constraints.edge_constraints
+        return not self.constraints.table.edge_blocked(state_1.time, state_1.location, state_2.location)
 
     def is_solution(self, agent_name):
         pass
 
     def admissible_heuristic(self, state, agent_name):
         goal = self.env.agent_dict[agent_name].target
-        return fabs(state.location.x - goal.x) + fabs(state.location.y - goal.y)
+        return self.env.distance_maps.distance(state.location, goal)
 
     def get_location_state(self, agent_name):
         return State(0, self.env.agent_dict[agent_name].location)
     
     def is_at_goal(self, state, agent_name):
-        goal_state = State(0, self.env.agent_dict[agent_name].target)
-        return state.is_equal_except_time(goal_state)
+        return state.location == self.env.agent_dict[agent_name].target \
+            and self.constraints.table.can_stop_at(state.time, state.location)
     
-    def compute_solution(self):
-        solution = {}
+    def compute_solution(self, solution = None):
+        # plan the agents that have no path in solution yet
+        solution = dict(solution or {})
         for agent in self.env.agent_dict.keys():
-            self.constraints = self.constraint_dict.setdefault(agent, Constraints())
-            local_solution = self.a_star.search(agent)
+            if agent in solution:
+                continue
+            local_solution = self.compute_agent_solution(agent)
             if not local_solution:
                 return False
             solution.update({agent:local_solution})
         return solution
+
+    def remember_solution(self, solution):
+        if not self.warm_start:
+            return
+        self.previous_solution = solution
+        self.previous_targets = {agent: (self.env.agent_dict[agent].task, self.env.agent_dict[agent].target) for agent in solution.keys()}
+
+    def get_warm_start_path(self, agent_name):
+        # the previous path of the agent, if it still follows it to the same task and target
+        agent = self.env.agent_dict[agent_name]
+        if agent_name not in self.previous_solution:
+            return False
+        task, target = self.previous_targets[agent_name]
+        if task is not agent.task or target != agent.target:
+            return False
+        return shift_path(self.previous_solution[agent_name], self.env.time_step_per_planning, agent.location)
+
+    def get_warm_start_solution(self):
+        solution = {}
+        if not self.warm_start:
+            return solution
+        for agent in self.env.agent_dict.keys():
+            local_solution = self.get_warm_start_path(agent)
+            if local_solution:
+                solution[agent] = local_solution
+        self.warm_started_paths = len(solution)
+        return solution
+
+    def compute_agent_solution(self, agent):
+        self.constraints = self.constraint_dict.setdefault(agent, Constraints())
+        self.low_level_searches += 1
+        time_start = time.perf_counter()
+        local_solution = self.a_star.search(agent)
+        self.stats.low_level_time += time.perf_counter() - time_start
+        if self.hooks:
+            self.call_hook('low_level', agent, local_solution)
+        return local_solution
+
+    def compute_agent_solutions(self, tasks):
+        # (agent, constraint_dict) pairs that are planned independently of each other
+        solutions = []
+        for agent, constraint_dict in tasks:
+            self.constraint_dict = constraint_dict
+            solutions.append(self.compute_agent_solution(agent))
+        return solutions
     
 
     def compute_solution_cost(self, solution):
@@ -314,76 +577,274 @@ class CBS:
 
 
 class PBS:
-    def __init__(self, environment):
+    """
+    Priority-based search: a depth-first search over partial priority orders.
+    Each node branches on its first conflict by giving one of the two agents
+    priority over the other, and only the agents below the new edge are
+    replanned around the paths of the agents above them.
+    """
+    def __init__(self, environment, windowed = False, max_nodes = None, time_limit = None, warm_start = False,\
+                 hooks = None):
         self.env = environment
+        self.windowed = windowed
         self.a_star = AStar(self)
+        self.conflict_detector = ConflictDetector()
         self.constraints = Constraints()
         self.constraint_dict = {}
-        self.retry_time_if_fail = 5
-        
-    def search(self):
-        
+        # budgets of one search, None means unlimited
+        self.max_nodes = max_nodes
+        self.time_limit = time_limit
+        self.expanded_nodes = 0
+        self.low_level_searches = 0
+        # agents from high to low priority in the last solution
+        self.priority_list = []
+        self.priority_dict = {}
+        # start from the priorities and, where still valid, the paths of the previous window
+        self.warm_start = warm_start
+        self.previous_solution = {}
+        self.previous_targets = {}
+        self.warm_started_paths = 0
+        # counters of the last search, also attached to its result
+        self.stats = SearchStats()
+        # event -> callback: 'generate'(node), 'expand'(node), 'low_level'(agent, path), 'solution'(plan)
+        self.hooks = hooks or {}
+        # returns True when the search should stop, e.g. another worker already found a solution
+        self.cancelled = None
+
+    def budget_exhausted(self, start_time):
+        if self.max_nodes is not None and self.expanded_nodes >= self.max_nodes:
+            return True
+        if self.time_limit is not None and time.time() - start_time >= self.time_limit:
+            return True
+        if self.cancelled is not None and self.cancelled():
+            return True
+        return False
+
+    def call_hook(self, event, *args):
+        hook = self.hooks.get(event)
+        if hook:
+            hook(*args)
+
+    def add_open_node(self, stack, node):
+        stack.append(node)
+        self.stats.nodes_generated += 1
+        if len(stack) > self.stats.peak_open_size:
+            self.stats.peak_open_size = len(stack)
+        if self.hooks:
+            self.call_hook('generate', node)
+
+    def finish_stats(self, start_time, node = None):
+        self.stats.runtime = time.time() - start_time
+        self.stats.nodes_expanded = self.expanded_nodes
+        self.stats.low_level_searches = self.low_level_searches
+        self.stats.low_level_expansions = self.a_star.expansions - self.stats.low_level_expansions
+        if node is not None:
+            self.stats.constraints = sum([len(higher) for higher in node.priority_dict.values()])
+
+    def search(self, initial_priorities = None):
+        # initial_priorities: agent -> agents above it, to start from a given (partial) order
+        solution = self.search_solution(initial_priorities)
+        if not solution:
+            return Plan({}, self.stats)
+
+        print("solution found")
+        print("low-level searches: " + str(self.low_level_searches))
+
+        self.remember_solution(solution)
+        self.update_path_list(solution)
+
+        plan = Plan(self.generate_plan(solution), self.stats)
+        if self.hooks:
+            self.call_hook('solution', plan)
+        return plan
+
+    def search_solution(self, initial_priorities = None, fallback = True):
+        # fallback: start without priorities when initial_priorities give no root, else fail with no node generated
+
+        start_time = time.time()
+        self.a_star.deadline = None if self.time_limit is None else start_time + self.time_limit
+        self.a_star.cancelled = self.cancelled
+        self.expanded_nodes = 0
+        self.low_level_searches = 0
+        self.warm_started_paths = 0
+        self.stats = SearchStats()
+        # expansions of this search, counted from the running total of AStar
+        self.stats.low_level_expansions = self.a_star.expansions
+        if initial_priorities is None and self.warm_start:
+            initial_priorities = self.priority_dict
+
+        agents = list(self.env.agent_dict.keys())
+        start = False
+        if initial_priorities:
+            start = self.create_root(agents, initial_priorities)
+        if not start and (fallback or not initial_priorities):
+            start = self.create_root(agents, {})
+        if not start:
+            self.finish_stats(start_time)
+            return False
+
+        stack = []
+        self.add_open_node(stack, start)
+
+        while stack:
+            if self.budget_exhausted(start_time):
+                print("search budget exhausted after " + str(self.expanded_nodes) + " nodes")
+                break
+            P = stack.pop()
+            self.expanded_nodes += 1
+            if self.hooks:
+                self.call_hook('expand', P)
+
+            conflict = self.get_first_conflict(P.solution)
+            if not conflict:
+                self.priority_list = self.topological_sort(P, list(P.solution.keys()))
+                self.priority_dict = P.priority_dict
+                self.finish_stats(start_time, P)
+                return P.solution
+
+            children = []
+            for high, low in ((conflict.agent_1, conflict.agent_2), (conflict.agent_2, conflict.agent_1)):
+                # the opposite order is already implied, this edge would make a cycle
+                if low in self.get_higher_agents(P, high):
+                    continue
+                new_node = HighLevelNode()
+                new_node.depth = P.depth + 1
+                new_node.priority_dict = dict(P.priority_dict)
+                new_node.priority_dict[low] = P.priority_dict[low] | {high}
+                new_node.solution = dict(P.solution)
+                if not self.update_plan(new_node, low):
+                    continue
+                new_node.cost = self.compute_solution_cost(new_node.solution)
+                children.append(new_node)
+
+            # depth-first, the cheaper child is explored first
+            children.sort(key = lambda node: node.cost, reverse = True)
+            for new_node in children:
+                self.add_open_node(stack, new_node)
+
+        self.finish_stats(start_time)
+        return False
+
+    def create_root(self, agents, priorities):
         start = HighLevelNode()
-        
-        for agent_name in self.env.agent_dict.keys():
-            start.priority_list.append(agent_name) 
-        print(start.priority_list)
-#        print(self.constraints)
-        
-        start.solution = self.compute_solution(start.priority_list)
-        
-        if start.solution:
-            
-            print("solution found")
-                
-            self.update_path_list(start.solution)
-            
-            return self.generate_plan(start.solution)
-        
-        count = 0
-        
-        while count < self.retry_time_if_fail:
-            
-            shuffle(start.priority_list)
-            print(start.priority_list)
-            start.solution = self.compute_solution(start.priority_list)
-        
-            if start.solution:
-            
-                print("solution found")
-                    
-                self.update_path_list(start.solution)
-                
-                return self.generate_plan(start.solution)
-            
-            count += 1
-        
+        for agent_name in agents:
+            start.priority_dict[agent_name] = set(priorities.get(agent_name, ())) & set(agents)
+        start.solution = self.compute_solution(start, agents)
+        if not start.solution:
+            return False
+        start.cost = self.compute_solution_cost(start.solution)
+        return start
+
+    def get_higher_agents(self, node, agent):
+        higher = set()
+        frontier = list(node.priority_dict[agent])
+        while frontier:
+            other = frontier.pop()
+            if other in higher:
+                continue
+            higher.add(other)
+            frontier += node.priority_dict[other]
+        return higher
+
+    def get_lower_agents(self, node, agent):
+        return {other for other in node.priority_dict.keys() if agent in self.get_higher_agents(node, other)}
+
+    def topological_sort(self, node, agents):
+        # agents ordered so that everyone comes after the agents above them
+        agent_set = set(agents)
+        in_degree = {agent: len(node.priority_dict[agent] & agent_set) for agent in agents}
+        order = [agent for agent in agents if in_degree[agent] == 0]
+        index = 0
+        while index < len(order):
+            for agent in agents:
+                if order[index] in node.priority_dict[agent]:
+                    in_degree[agent] -= 1
+                    if in_degree[agent] == 0:
+                        order.append(agent)
+            index += 1
+        return order
+
+    def update_plan(self, node, agent):
+        # replan agent and the agents below it that now collide with a higher agent
+        agents = self.topological_sort(node, [agent] + list(self.get_lower_agents(node, agent)))
+        for other in agents:
+            higher = self.get_higher_agents(node, other)
+            if other != agent and not self.collides(node.solution, other, higher):
+                continue
+            local_solution = self.compute_agent_solution(node.solution, other, higher)
+            if not local_solution:
+                return False
+            node.solution[other] = local_solution
+        return True
+
+    def collides(self, solution, agent, higher_agents):
+        for other in higher_agents:
+            sub_solution = {other: solution[other], agent: solution[agent]}
+            if self.get_first_conflict(sub_solution):
+                return True
+        return False
+
+    def compute_solution(self, node, priority_list):
+        solution = {}
+        for agent in self.topological_sort(node, priority_list):
+            higher_agents = self.get_higher_agents(node, agent)
+            if self.warm_start:
+                # keep the previous path unless it runs into an agent above
+                solution[agent] = self.get_warm_start_path(agent)
+                if solution[agent] and not self.collides(solution, agent, higher_agents):
+                    self.warm_started_paths += 1
+                    continue
+            local_solution = self.compute_agent_solution(solution, agent, higher_agents)
+            if not local_solution:
+                return False
+            solution.update({agent:local_solution})
+        return solution
 
-        return {}
+    def remember_solution(self, solution):
+        if not self.warm_start:
+            return
+        self.previous_solution = solution
+        self.previous_targets = {agent: (self.env.agent_dict[agent].task, self.env.agent_dict[agent].target) for agent in solution.keys()}
+
+    def get_warm_start_path(self, agent_name):
+        # the previous path of the agent, if it still follows it to the same task and target
+        agent = self.env.agent_dict[agent_name]
+        if agent_name not in self.previous_solution:
+            return False
+        task, target = self.previous_targets[agent_name]
+        if task is not agent.task or target != agent.target:
+            return False
+        return shift_path(self.previous_solution[agent_name], self.env.time_step_per_planning, agent.location)
+
+    def compute_agent_solution(self, solution, agent, higher_agents):
+        self.constraints = Constraints()
+        for other in higher_agents:
+            self.create_constraints_from_path(solution[other])
+        self.low_level_searches += 1
+        time_start = time.perf_counter()
+        local_solution = self.a_star.search(agent)
+        self.stats.low_level_time += time.perf_counter() - time_start
+        if self.hooks:
+            self.call_hook('low_level', agent, local_solution)
+        return local_solution
     
     def get_neighbors(self, state, agent_name):
         neighbors = []
-
-        # Wait action
-        n = State(state.time + 1, state.location)
-        if self.state_valid(n, agent_name):
-            neighbors.append(n)
-        # Up action
-        n = State(state.time + 1, Location(state.location.x, state.location.y+1))
-        if self.state_valid(n, agent_name) and self.transition_valid(state, n):
-            neighbors.append(n)
-        # Down action
-        n = State(state.time + 1, Location(state.location.x, state.location.y-1))
-        if self.state_valid(n, agent_name) and self.transition_valid(state, n):
-            neighbors.append(n)
-        # Left action
-        n = State(state.time + 1, Location(state.location.x-1, state.location.y))
-        if self.state_valid(n, agent_name) and self.transition_valid(state, n):
-            neighbors.append(n)
-        # Right action
-        n = State(state.time + 1, Location(state.location.x+1, state.location.y))
-        if self.state_valid(n, agent_name) and self.transition_valid(state, n):
-            neighbors.append(n)
+        locations = self.env.locations
+        location = state.location
+        cell = location.y * self.env.dimension[0] + location.x
+        time = state.time + 1
+
+        # Wait, up, down, left and right actions that stay on the map
+        for next_cell in self.env.neighbor_table[cell]:
+            if next_cell == cell:
+                n = State(time, location)
+                if self.state_valid(n, agent_name):
+                    neighbors.append(n)
+                continue
+            n = State(time, locations[next_cell])
+            if self.state_valid(n, agent_name) and self.transition_valid(state, n):
+                neighbors.append(n)
         return neighbors
     
     def state_wait(self, state):
@@ -391,45 +852,35 @@ class PBS:
 
 
     def get_first_conflict(self, solution):
-        print(solution['agent1'])
-        max_t = max([len(plan) for plan in solution.values()])
-        result = Conflict()
-        for t in range(max_t):
-            for agent_1, agent_2 in combinations(solution.keys(), 2):
-                state_1 = self.get_state(agent_1, solution, t)
-                state_2 = self.get_state(agent_2, solution, t)
-                if state_1.is_equal_except_time(state_2):
-                    result.time = t
-                    result.type = Conflict.VERTEX
-                    result.location_1 = state_1.location
-                    result.agent_1 = agent_1
-                    result.agent_2 = agent_2
-                    return result
-
-            for agent_1, agent_2 in combinations(solution.keys(), 2):
-                state_1a = self.get_state(agent_1, solution, t)
-                state_1b = self.get_state(agent_1, solution, t+1)
-
-                state_2a = self.get_state(agent_2, solution, t)
-                state_2b = self.get_state(agent_2, solution, t+1)
-
-                if state_1a.is_equal_except_time(state_2b) and state_1b.is_equal_except_time(state_2a):
-                    result.time = t
-                    result.type = Conflict.EDGE
-                    result.agent_1 = agent_1
-                    result.agent_2 = agent_2
-                    result.location_1 = state_1a.location
-                    result.location_2 = state_1b.location
-                    return result
-        return False
+        time_start = time.perf_counter()
+        conflict = self.conflict_detector.get_first_conflict(solution, self.get_conflict_horizon())
+        self.stats.conflict_time += time.perf_counter() - time_start
+        return conflict
+
+    def get_conflict_horizon(self):
+        # the executed part of a plan must always be conflict-free,
+        # so the window never ends before the next replanning
+        if not self.windowed:
+            return None
+        return max(self.env.window_size, self.env.time_step_per_planning)
 
     def create_constraints_from_path(self, solution):
         if(not len(solution)):
             return
-        self.constraints.vertex_constraints |= {VertexConstraint(solution[0].time, solution[0].location)}
-        for i in range(1,len(solution)):
-            self.constraints.vertex_constraints |= {VertexConstraint(solution[i].time, solution[i].location)}
-            self.constraints.edge_constraints |= {EdgeConstraint(solution[i-1].time, solution[i].location, solution[i-1].location)}
+        # in windowed mode lower priority agents ignore the path beyond the window
+        horizon = self.get_conflict_horizon()
+        length = len(solution) if horizon is None else min(len(solution), horizon + 1)
+        self.constraints.add_vertex_constraint(VertexConstraint(solution[0].time, solution[0].location))
+        for i in range(1,length):
+            self.constraints.add_vertex_constraint(VertexConstraint(solution[i].time, solution[i].location))
+            self.constraints.add_edge_constraint(EdgeConstraint(solution[i-1].time, solution[i].location, solution[i-1].location))
+        # the agent stays at the end of its path
+        last = solution[-1]
+        if horizon is None:
+            self.constraints.table.add_stay(last.time, last.location)
+        else:
+            for t in range(last.time + 1, horizon + 1):
+                self.constraints.add_vertex_constraint(VertexConstraint(t, last.location))
 
     
     def get_state(self, agent_name, solution, t):
@@ -439,48 +890,40 @@ class PBS:
             return solution[agent_name][-1]
 
     def state_valid(self, state, agent_name):
-        if(self.env.agent_dict[agent_name].is_idle()):
-            if State(0, self.env.agent_dict[agent_name].location).is_equal_except_time(state):
+        agent = self.env.agent_dict[agent_name]
+        location = state.location
+        if self.constraints.table.vertex_blocked(state.time, location):
+            return False
+        # the agent may enter the obstacles it starts from or has to visit
+        if(agent.is_idle()):
+            if location == agent.location:
                 return True
         else:
-            if State(0, self.env.agent_dict[agent_name].task.shelf_location).is_equal_except_time(state):
+            if location == agent.task.shelf_location:
                 return True
-            if State(0, self.env.agent_dict[agent_name].task.parking_location).is_equal_except_time(state):
+            if location == agent.task.parking_location:
                 return True
-            if State(0, self.env.agent_dict[agent_name].task.station_location).is_equal_except_time(state):
+            if location == agent.task.station_location:
                 return True
-        return state.location.x >= 0 and state.location.x < self.env.dimension[0] \
-            and state.location.y >= 0 and state.location.y < self.env.dimension[1] \
-            and VertexConstraint(state.time, state.location) not in self.constraints.vertex_constraints \
-            and (state.location.x, state.location.y) not in self.env.obstacles
+        # bounds are guaranteed by the neighbor table
+        return not self.env.grid[location.y * self.env.dimension[0] + location.x]
 
     def transition_valid(self, state_1, state_2):
-        return EdgeConstraint(state_1.time, state_1.location, state_2.location) not in self.constraints.edge_constraints
+        return not self.constraints.table.edge_blocked(state_1.time, state_1.location, state_2.location)
 
     def is_solution(self, agent_name):
         pass
 
     def admissible_heuristic(self, state, agent_name):
         goal = self.env.agent_dict[agent_name].target
-        return fabs(state.location.x - goal.x) + fabs(state.location.y - goal.y)
+        return self.env.distance_maps.distance(state.location, goal)
 
     def get_location_state(self, agent_name):
         return State(0, self.env.agent_dict[agent_name].location)
     
     def is_at_goal(self, state, agent_name):
-        goal_state = State(0, self.env.agent_dict[agent_name].target)
-        return state.is_equal_except_time(goal_state)
-    
-    def compute_solution(self, priority_list):
-        solution = {}
-        self.constraints = Constraints()
-        for agent in priority_list:
-            local_solution = self.a_star.search(agent)
-            if not local_solution:
-                return False #被卡住還有優先級高的人想塞進來
-            solution.update({agent:local_solution})
-            self.create_constraints_from_path(local_solution)
-        return solution
+        return state.location == self.env.agent_dict[agent_name].target \
+            and self.constraints.table.can_stop_at(state.time, state.location)
     
 
     def compute_solution_cost(self, solution):
@@ -0,0 +1,196 @@
+"""
+
+MAPF Simulator
+
+author: Justin Li (@justin871030)
+
+"""
+
+import sys
+sys.path.insert(0, './')
+from conflicts import Conflict
+from mdd import classify_conflict
+import heapq
+import itertools
+
+class ConflictGraphHeuristic:
+    """
+    CG heuristic of CBSH: agents are vertices, and two agents are joined when
+    their paths have a cardinal conflict. Resolving a cardinal conflict costs
+    at least one more step for one of the two agents, so the size of a minimum
+    vertex cover of the graph is an admissible estimate of the extra cost of
+    any solution under the node.
+    """
+    def __init__(self):
+        self.computations = 0
+
+    def reset(self):
+        self.computations = 0
+
+    def compute(self, solver, node):
+        self.computations += 1
+        edges = {}
+        for conflict in solver.conflict_detector.get_all_conflicts(node.solution, solver.get_conflict_horizon()):
+            pair = tuple(sorted((conflict.agent_1, conflict.agent_2)))
+            if pair in edges:
+                continue
+            cardinality = classify_conflict(conflict, solver.get_mdd(node, conflict.agent_1), solver.get_mdd(node, conflict.agent_2))
+            if cardinality == Conflict.CARDINAL:
+                edges[pair] = 1
+        return minimum_weighted_vertex_cover(edges)
+
+class DependencyGraphHeuristic:
+    """
+    WDG heuristic of CBSH2: two agents whose paths conflict are joined by an
+    edge weighted with the extra cost of solving them alone as a pair, under
+    their constraints of the node, over their current path costs. The minimum
+    weighted vertex cover of the graph (integers on the agents, every edge
+    covered by the sum of its ends) is admissible.
+
+    The pairs are solved by a two-agent CBS of at most max_pair_nodes nodes;
+    when it runs out, the smallest cost left in its open list still bounds the
+    edge. Pair results depend only on the constraints of the two agents, so
+    they are cached on them for the whole search.
+    """
+    def __init__(self, max_pair_nodes = 16):
+        self.max_pair_nodes = max_pair_nodes
+        self.pair_cache = {}
+        self.computations = 0
+        self.pair_searches = 0
+        self.cache_hits = 0
+
+    def reset(self):
+        self.pair_cache = {}
+        self.computations = 0
+        self.pair_searches = 0
+        self.cache_hits = 0
+
+    def compute(self, solver, node):
+        self.computations += 1
+        edges = {}
+        for conflict in solver.conflict_detector.get_all_conflicts(node.solution, solver.get_conflict_horizon()):
+            pair = tuple(sorted((conflict.agent_1, conflict.agent_2)))
+            if pair in edges:
+                continue
+            weight = self.get_pair_cost(solver, node, *pair)
+            if weight > 0:
+                edges[pair] = weight
+        return minimum_weighted_vertex_cover(edges)
+
+    def get_pair_cost(self, solver, node, agent_1, agent_2):
+        constraints_1 = node.constraint_dict[agent_1]
+        constraints_2 = node.constraint_dict[agent_2]
+        key = (agent_1, frozenset(constraints_1.vertex_constraints), frozenset(constraints_1.edge_constraints),\
+               agent_2, frozenset(constraints_2.vertex_constraints), frozenset(constraints_2.edge_constraints))
+        if key in self.pair_cache:
+            self.cache_hits += 1
+            return self.pair_cache[key]
+        constraint_dict = solver.constraint_dict
+        self.pair_cache[key] = self.solve_pair(solver, node, agent_1, agent_2)
+        solver.constraint_dict = constraint_dict
+        return self.pair_cache[key]
+
+    def solve_pair(self, solver, node, agent_1, agent_2):
+        # best-first CBS on the two agents, from their paths and constraints in node
+        self.pair_searches += 1
+        solution = {agent_1: node.solution[agent_1], agent_2: node.solution[agent_2]}
+        base_cost = solver.compute_solution_cost(solution)
+        constraint_dict = {agent_1: node.constraint_dict[agent_1], agent_2: node.constraint_dict[agent_2]}
+        counter = itertools.count()
+        open_list = [(base_cost, next(counter), constraint_dict, solution)]
+        expanded = 0
+        while open_list:
+            if expanded >= self.max_pair_nodes:
+                return open_list[0][0] - base_cost
+            cost, _, constraint_dict, solution = heapq.heappop(open_list)
+            expanded += 1
+            conflict = solver.get_first_conflict(solution)
+            if not conflict:
+                return cost - base_cost
+            for agent, constraints in solver.create_constraints_from_conflict(conflict).items():
+                child_constraint_dict = dict(constraint_dict)
+                child_constraint_dict[agent] = constraint_dict[agent].copy()
+                child_constraint_dict[agent].add_constraint(constraints)
+                solver.constraint_dict = child_constraint_dict
+                local_solution = solver.compute_agent_solution(agent)
+                if not local_solution:
+                    continue
+                child_solution = dict(solution)
+                child_solution[agent] = local_solution
+                heapq.heappush(open_list, (solver.compute_solution_cost(child_solution), next(counter),\
+                                           child_constraint_dict, child_solution))
+        # the pair has no solution within the A* horizon, fall back to no estimate
+        return 0
+
+def minimum_weighted_vertex_cover(edges, max_component_size = 10):
+    # edges: (agent, agent) -> weight; sum over the connected components
+    neighbors = {}
+    for (agent_1, agent_2), weight in edges.items():
+        neighbors.setdefault(agent_1, {})[agent_2] = weight
+        neighbors.setdefault(agent_2, {})[agent_1] = weight
+    total = 0
+    visited = set()
+    for agent in neighbors.keys():
+        if agent in visited:
+            continue
+        component = [agent]
+        visited.add(agent)
+        for member in component:
+            for other in neighbors[member].keys():
+                if other not in visited:
+                    visited.add(other)
+                    component.append(other)
+        if len(component) > max_component_size:
+            total += matching_bound(component, neighbors)
+        else:
+            total += exact_cover(component, neighbors)
+    return total
+
+def matching_bound(component, neighbors):
+    # edges of a matching need disjoint values, so a greedy matching is a lower bound
+    matched = set()
+    total = 0
+    members = set(component)
+    pairs = sorted([(weight, agent_1, agent_2) for agent_1 in component\
+                    for agent_2, weight in neighbors[agent_1].items() if agent_1 < agent_2 and agent_2 in members], reverse = True)
+    for weight, agent_1, agent_2 in pairs:
+        if agent_1 not in matched and agent_2 not in matched:
+            matched.add(agent_1)
+            matched.add(agent_2)
+            total += weight
+    return total
+
+def exact_cover(component, neighbors):
+    # branch and bound over the values of the agents, most connected agents first
+    order = sorted(component, key = lambda agent: -len(neighbors[agent]))
+    values = {}
+    best = [sum([max(neighbors[agent].values()) for agent in order])]
+
+    def assign(i, cost):
+        if cost + matching_bound(order[i:], neighbors) >= best[0]:
+            return
+        if i == len(order):
+            best[0] = cost
+            return
+        agent = order[i]
+        # the value must cover every edge to an agent already assigned
+        lowest = 0
+        for other, weight in neighbors[agent].items():
+            if other in values:
+                lowest = max(lowest, weight - values[other])
+        highest = max(lowest, max(neighbors[agent].values()))
+        for value in range(lowest, highest + 1):
+            values[agent] = value
+            assign(i + 1, cost + value)
+        del values[agent]
+
+    assign(0, 0)
+    return best[0]
+
+def get_heuristic(name):
+    # high-level heuristic of CBS by name: none, cg or wdg
+    if name == 'cg':
+        return ConflictGraphHeuristic()
+    if name == 'wdg':
+        return DependencyGraphHeuristic()
+    return None
@@ -0,0 +1,136 @@
+"""
+
+MAPF Simulator
+
+author: Justin Li (@justin871030)
+
+"""
+
+import sys
+sys.path.insert(0, './')
+from environment import Location
+
+
+class Conflict:
+    VERTEX = 1
+    EDGE = 2
+    NON_CARDINAL = 0
+    SEMI_CARDINAL = 1
+    CARDINAL = 2
+    def __init__(self):
+        self.time = -1
+        self.type = -1
+
+        self.agent_1 = ''
+        self.agent_2 = ''
+
+        self.location_1 = Location()
+        self.location_2 = Location()
+
+    def __str__(self):
+        return '(' + str(self.time) + ', ' + self.agent_1 + ', ' + self.agent_2 + \
+             ', '+ str(self.location_1) + ', ' + str(self.location_2) + ')'
+
+class ConflictDetector:
+    """
+    Finds conflicts with a space-time occupancy index instead of comparing every
+    pair of agents: at each timestep the cells are keyed in a dict for vertex
+    conflicts and the traversed edges for edge conflicts, so a solution is
+    checked in O(T*N) plus the number of conflicts found.
+    """
+
+    def get_first_conflict(self, solution, max_time = None):
+        conflicts = self.find_conflicts(solution, first_only = True, max_time = max_time)
+        if not conflicts:
+            return False
+        return conflicts[0]
+
+    def get_all_conflicts(self, solution, max_time = None):
+        return self.find_conflicts(solution, max_time = max_time)
+
+    def count_conflicts(self, solution, max_time = None):
+        return len(self.find_conflicts(solution, max_time = max_time))
+
+    def count_conflicts_per_agent(self, conflicts):
+        counts = {}
+        for conflict in conflicts:
+            counts[conflict.agent_1] = counts.get(conflict.agent_1, 0) + 1
+            counts[conflict.agent_2] = counts.get(conflict.agent_2, 0) + 1
+        return counts
+
+    def find_conflicts(self, solution, first_only = False, max_time = None):
+        # in first_only mode, return the conflict the pairwise scan would have met
+        # first: earliest time, vertex before edge, then lowest agent pair.
+        # with max_time, only vertices up to max_time and edges ending by it are checked
+        if not solution:
+            return []
+        agents = list(solution.keys())
+        paths = [solution[agent] for agent in agents]
+        cells = [[state.location for state in path] for path in paths]
+        max_t = max([len(path) for path in paths])
+        if max_time is not None:
+            max_t = min(max_t, max_time + 1)
+
+        conflicts = []
+        for t in range(max_t):
+            vertex_conflicts = []
+            vertex_index = {}
+            for i in range(len(agents)):
+                cell = cells[i][t] if t < len(cells[i]) else cells[i][-1]
+                occupants = vertex_index.get(cell)
+                if occupants is None:
+                    vertex_index[cell] = [i]
+                    continue
+                for j in occupants:
+                    vertex_conflicts.append((j, i))
+                occupants.append(i)
+            if vertex_conflicts:
+                if first_only:
+                    j, i = min(vertex_conflicts)
+                    return [self.make_vertex_conflict(t, agents[j], agents[i], paths[j])]
+                for j, i in vertex_conflicts:
+                    conflicts.append(self.make_vertex_conflict(t, agents[j], agents[i], paths[j]))
+
+            if max_time is not None and t + 1 > max_time:
+                continue
+            edge_conflicts = []
+            edge_index = {}
+            for i in range(len(agents)):
+                cell_a = cells[i][t] if t < len(cells[i]) else cells[i][-1]
+                cell_b = cells[i][t+1] if t+1 < len(cells[i]) else cells[i][-1]
+                if cell_a == cell_b:
+                    continue
+                for j in edge_index.get((cell_b, cell_a), ()):
+                    edge_conflicts.append((j, i))
+                edge_index.setdefault((cell_a, cell_b), []).append(i)
+            if edge_conflicts:
+                if first_only:
+                    j, i = min(edge_conflicts)
+                    return [self.make_edge_conflict(t, agents[j], agents[i], paths[j])]
+                for j, i in edge_conflicts:
+                    conflicts.append(self.make_edge_conflict(t, agents[j], agents[i], paths[j]))
+        return conflicts
+
+    def get_state(self, path, t):
+        if t < len(path):
+            return path[t]
+        return path[-1]
+
+    def make_vertex_conflict(self, time, agent_1, agent_2, path_1):
+        result = Conflict()
+        result.time = time
+        result.type = Conflict.VERTEX
+        result.agent_1 = agent_1
+        result.agent_2 = agent_2
+        result.location_1 = self.get_state(path_1, time).location
+        return result
+
+    def make_edge_conflict(self, time, agent_1, agent_2, path_1):
+        result = Conflict()
+        result.time = time
+        result.type = Conflict.EDGE
+        result.agent_1 = agent_1
+        result.agent_2 = agent_2
+        result.location_1 = self.get_state(path_1, time).location
+        result.location_2 = self.get_state(path_1, time+1).location
+        return result
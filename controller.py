@@ -10,129 +10,324 @@ import sys
 sys.path.insert(0, './')
 from math import fabs
 from environment import Agent_Task
+from assignment import linear_sum_assignment
+from spatial_index import GridIndex
+from collections import deque
+import heapq
+import numpy as np
 
 class Order:
     def __init__(self, shelf_location):
         self.shelf_location = shelf_location
+        # set by the controller when the order is queued and when it is given to an agent
+        self.arrival_time = None
+        self.assign_time = None
     def set_shelf_location(location):
         self.shelf_location = shelf_location
+
+    def get_time_in_queue(self, time):
+        if self.assign_time is not None:
+            return self.assign_time - self.arrival_time
+        return time - self.arrival_time
+
+class OrderQueue:
+    """
+    Pending orders, first in first out, kept in one FIFO bucket per shelf.
+
+    Buckets whose shelf may be in place are kept in a heap by the arrival of
+    their first order, so peek gives the oldest order that can be served
+    without looking at the others. The controller holds a shelf when it is
+    taken (or found not in place) and releases it when it is back; orders of
+    held shelves cost nothing until then.
+    """
+    def __init__(self):
+        self.buckets = {}
+        self.ready = []
+        self.held = set()
+        self.count = 0
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        # every pending order, in arrival order
+        for sequence, order in heapq.merge(*self.buckets.values()):
+            yield order
+
+    def add(self, order):
+        bucket = self.buckets.get(order.shelf_location)
+        if bucket is None:
+            bucket = self.buckets[order.shelf_location] = deque()
+        bucket.append((self.count, order))
+        if len(bucket) == 1 and order.shelf_location not in self.held:
+            heapq.heappush(self.ready, (self.count, order.shelf_location))
+        self.count += 1
+        self.length += 1
+
+    def peek(self):
+        # oldest order of a shelf that is not held, None if there is none
+        while self.ready:
+            sequence, shelf_location = self.ready[0]
+            bucket = self.buckets.get(shelf_location)
+            if shelf_location not in self.held and bucket and bucket[0][0] == sequence:
+                return bucket[0][1]
+            heapq.heappop(self.ready)
+        return None
+
+    def pop(self):
+        order = self.peek()
+        if order is None:
+            return None
+        heapq.heappop(self.ready)
+        bucket = self.buckets[order.shelf_location]
+        bucket.popleft()
+        if bucket:
+            heapq.heappush(self.ready, (bucket[0][0], order.shelf_location))
+        else:
+            del self.buckets[order.shelf_location]
+        self.length -= 1
+        return order
+
+    def hold(self, shelf_location):
+        self.held.add(shelf_location)
+
+    def release(self, shelf_location):
+        if shelf_location not in self.held:
+            return
+        self.held.remove(shelf_location)
+        bucket = self.buckets.get(shelf_location)
+        if bucket:
+            heapq.heappush(self.ready, (bucket[0][0], shelf_location))
         
-class Station:
+class ResourcePool:
+    """
+    Locations that are taken and given back. idle_locations and
+    busy_locations are dicts used as ordered sets, so taking or freeing a
+    given location is O(1), and get_idle_location still takes the location
+    freed last, as it did with lists.
+    """
     def __init__(self, locations):
-        self.idle_locations = locations
-        self.busy_locations = []
-    
+        self.idle_locations = dict.fromkeys(locations)
+        self.busy_locations = {}
+
     def get_idle_location(self):
         if not self.idle_locations:
             return False
-        location = self.idle_locations.pop(-1)
-        self.busy_locations.append(location)
+        location = self.idle_locations.popitem()[0]
+        self.busy_locations[location] = None
         return location
-    
+
+    def get_location(self, target):
+        if target not in self.idle_locations:
+            return False
+        del self.idle_locations[target]
+        self.busy_locations[target] = None
+        return target
+
     def free_busy_location(self, location):
-        for busy_location_index in range(len(self.busy_locations)):
-            if(location == self.busy_locations[busy_location_index]):
-                self.idle_locations.append(self.busy_locations.pop(busy_location_index))
-                break
+        if location in self.busy_locations:
+            del self.busy_locations[location]
+            self.idle_locations[location] = None
 
-class Parking_Place:
+    def get_idle_count(self):
+        return len(self.idle_locations)
+
+    def get_busy_count(self):
+        return len(self.busy_locations)
+
+class Station(ResourcePool):
+    pass
+
+class Parking_Place(ResourcePool):
     def __init__(self, locations):
-        self.idle_locations = locations
-        self.busy_locations = []
+        ResourcePool.__init__(self, locations)
+        # the idle locations again, for nearest queries
+        self.idle_index = GridIndex()
+        for location in self.idle_locations:
+            self.idle_index.add(location, location)
     
     def get_nearest_idle_location(self, start_location):
         if not self.idle_locations:
             return False
-        
-        temp_distance = float('inf')
-        temp_index = -1
-
-        for index in range(len(self.idle_locations)):
-            distance = self.location_distance(self.idle_locations[index], start_location)
-            if(distance < temp_distance):
-                temp_distance = distance
-                temp_index = index
-        location = self.idle_locations.pop(temp_index)
-        self.busy_locations.append(location)
-        
-        return location
+        return self.get_location(self.idle_index.nearest(start_location)[0])
+
+    def get_nearest_idle_locations(self, start_location, k):
+        # the k nearest idle locations, nearest first, without taking them
+        return self.idle_index.nearest(start_location, k)
     
     def get_idle_location(self):
-        if not self.idle_locations:
-            return False
-        
-        location = self.idle_locations.pop(-1)
-        self.busy_locations.append(location)
+        location = ResourcePool.get_idle_location(self)
+        if location:
+            self.idle_index.remove(location)
+        return location
+
+    def get_location(self, target):
+        location = ResourcePool.get_location(self, target)
+        if location:
+            self.idle_index.remove(location)
         return location
     
     def free_busy_location(self, location):
-        for busy_location_index in range(len(self.busy_locations)):
-            if(location == self.busy_locations[busy_location_index]):
-                self.idle_locations.append(self.busy_locations.pop(busy_location_index))
-                break
+        if location in self.busy_locations:
+            ResourcePool.free_busy_location(self, location)
+            self.idle_index.add(location, location)
                     
     def location_distance(self, location1, location2):
         return fabs(location1.x - location2.x) + fabs(location1.y - location2.y)
 
-class Shelf_Place:
-    def __init__(self, locations):
-        self.idle_locations = locations
-        self.busy_locations = []
-    
-    def get_location(self, target):
-        for index in range(len(self.idle_locations)):
-            if(self.idle_locations[index] == target):
-                location = self.idle_locations.pop(index)
-                self.busy_locations.append(location)
-                return location
-        return False
-    
-    def free_busy_location(self, location):
-        for busy_location_index in range(len(self.busy_locations)):
-            if(location == self.busy_locations[busy_location_index]):
-                self.idle_locations.append(self.busy_locations.pop(busy_location_index))
-                break
+class Shelf_Place(ResourcePool):
+    pass
 
     
 class Controller:
-    def __init__(self, agent_dict, parking_place, shelf_place, station_list):
+    """
+    Turns orders into tasks of idle agents.
+
+    assignment 'greedy' takes the orders one by one and gives each the
+    nearest idle agent (Manhattan distance). 'batch' takes as many orders
+    as there are idle agents and free station places, first in first out,
+    and gives them the agents of least total distance, on the grid when
+    distance_maps (env.distance_maps) is given. Both stop as soon as no
+    idle agent or station place is left.
+
+    Orders wait in an OrderQueue. Their arrival_time and assign_time are
+    the times passed to add_orders and deal_with_orders, and
+    get_queue_stats reports the queue depth and the time in queue.
+    """
+    def __init__(self, agent_dict, parking_place, shelf_place, station_list, assignment = 'greedy', distance_maps = None):
         self.agent_dict = agent_dict
         self.parking_place = parking_place
         self.shelf_place = shelf_place
         self.station_list = station_list
-        self.order_queue = []
+        self.assignment = assignment
+        self.distance_maps = distance_maps
+        self.order_queue = OrderQueue()
+        # current time of the simulation, and how long the assigned orders waited
+        self.time = 0
+        self.queue_times = []
+        # idle agents by location, updated when tasks are given out and finished
+        self.agent_ranks = {}
+        self.idle_agents = GridIndex()
+        for rank, (agent_name, agent) in enumerate(agent_dict.items()):
+            self.agent_ranks[agent_name] = rank
+            if agent.is_idle():
+                self.idle_agents.add(agent_name, agent.location, rank)
         
     def init_parking_places_with_agents(self):
         for agent_name, agent in self.agent_dict.items():
-            for index in range(len(self.parking_place.idle_locations)):
-                if(agent.location == self.parking_place.idle_locations[index]):
-                    self.parking_place.busy_locations.append(self.parking_place.idle_locations.pop(index))
-                    break
+            self.parking_place.get_location(agent.location)
     
-    def add_orders(self, orders):
-        self.order_queue = self.order_queue + orders
+    def add_orders(self, orders, time = None):
+        if time is not None:
+            self.time = time
+        for order in orders:
+            order.arrival_time = self.time
+            self.order_queue.add(order)
+
+    def get_capacity(self):
+        # tasks that can still be given out: one per idle agent and free station place
+        return min(len(self.idle_agents), sum([station.get_idle_count() for station in self.station_list]))
+
+    def pop_order(self):
+        order = self.order_queue.pop()
+        order.assign_time = self.time
+        self.queue_times.append(order.assign_time - order.arrival_time)
+        return order
         
-    def deal_with_orders(self):
+    def deal_with_orders(self, time = None):
+        if time is not None:
+            self.time = time
+
         if not self.order_queue:
             return {}
+
+        if(self.assignment == 'batch'):
+            return self.deal_with_orders_in_batch()
         
         except_list = []
         
         task_dict = {}
         
-        index = 0 
-        
-        while(index < len(self.order_queue)):
-            task = self.deal_with_one_order(self.order_queue[index], except_list)
+        while(self.get_capacity()):
+            order = self.order_queue.peek()
+            if order is None:
+                break
+            task = self.deal_with_one_order(order, except_list)
             if task:
                 task_dict.update(task)
-                self.order_queue.pop(index)
-            else:
-                index += 1
+                self.pop_order()
+            elif order.shelf_location in self.shelf_place.idle_locations:
+                break
+            # the shelf is taken now, or was not in place
+            self.order_queue.hold(order.shelf_location)
 
         return task_dict
                 
         
+    def deal_with_orders_in_batch(self):
+        capacity = self.get_capacity()
+
+        # the first orders of the queue whose shelves are in place, one per shelf
+        orders = []
+        while len(orders) < capacity:
+            order = self.order_queue.peek()
+            if order is None:
+                break
+            if order.shelf_location in self.shelf_place.idle_locations:
+                orders.append(self.pop_order())
+            self.order_queue.hold(order.shelf_location)
+        if not orders:
+            return {}
+
+        # candidates are the k nearest idle agents of every order by Manhattan distance, which is never more than
+        # the grid distance. Once the k-th candidate of every order is at least as far from it as every agent used,
+        # an agent left out is no nearer to any order than the agents used and cannot lower the cost; else k doubles
+        k = len(orders)
+        while True:
+            nearest_agents = [self.get_nearest_agents(order.shelf_location, k) for order in orders]
+            candidates = set()
+            for agent_names in nearest_agents:
+                candidates.update(agent_names)
+            idle_agents = sorted(candidates, key = lambda agent_name: self.agent_ranks[agent_name])
+            cost = self.get_distance_matrix([order.shelf_location for order in orders],\
+                                            [self.agent_dict[agent_name].location for agent_name in idle_agents])
+            order_rows, agent_columns = linear_sum_assignment(cost)
+            if k >= len(self.idle_agents):
+                break
+            farthest_used = cost[:, agent_columns].max(axis = 1)
+            if all([self.location_distance(self.agent_dict[agent_names[-1]].location, order.shelf_location) >= farthest\
+                    for order, agent_names, farthest in zip(orders, nearest_agents, farthest_used)]):
+                break
+            k *= 2
+
+        # there are at least as many idle agents as orders, every order gets one
+        task_dict = {}
+        for order_row, agent_column in zip(order_rows, agent_columns):
+            agent_name = idle_agents[agent_column]
+            shelf_location = self.shelf_place.get_location(orders[order_row].shelf_location)
+            for station in self.station_list:
+                station_location = station.get_idle_location()
+                if(station_location):
+                    break
+            task_dict[agent_name] = Agent_Task(shelf_location, station_location, self.agent_dict[agent_name].location)
+            self.idle_agents.remove(agent_name)
+        return task_dict
+
+    def get_distance_matrix(self, targets, locations):
+        # targets x locations of distances, on the grid when there are distance maps
+        xs = np.array([location.x for location in locations])
+        ys = np.array([location.y for location in locations])
+        cost = np.empty((len(targets), len(locations)))
+        for row, target in enumerate(targets):
+            manhattan = np.abs(xs - target.x) + np.abs(ys - target.y)
+            if self.distance_maps is None:
+                cost[row] = manhattan
+                continue
+            distances = np.frombuffer(self.distance_maps.get_map(target), dtype = np.intc)[ys * self.distance_maps.env.dimension[0] + xs]
+            cost[row] = np.where(distances == self.distance_maps.UNREACHABLE, manhattan, distances)
+        return cost
+
     def deal_with_one_order(self, order, except_list):
         
         shelf_location = self.shelf_place.get_location(order.shelf_location)
@@ -146,6 +341,7 @@ class Controller:
                         station_location = station.get_idle_location()
                         if(station_location):
                             except_list.append(agent_name)
+                            self.idle_agents.remove(agent_name)
                             return {agent_name: Agent_Task(shelf_location, station_location, parking_location)}
                         
                     #if fail, free
@@ -158,26 +354,45 @@ class Controller:
     
     def deal_with_finished_tasks(self, tasks):
         for task in tasks:
+            if task.agent_name in self.agent_dict:
+                agent = self.agent_dict[task.agent_name]
+                self.idle_agents.add(task.agent_name, agent.location, self.agent_ranks[task.agent_name])
             self.shelf_place.free_busy_location(task.shelf_location)
+            self.order_queue.release(task.shelf_location)
             for station in self.station_list:
                 station.free_busy_location(task.station_location)
         
+    def get_occupancy(self):
+        # busy places out of all places, per kind of place
+        stations = (sum([station.get_busy_count() for station in self.station_list]),\
+                    sum([station.get_busy_count() + station.get_idle_count() for station in self.station_list]))
+        return {
+            "shelves": (self.shelf_place.get_busy_count(), self.shelf_place.get_busy_count() + self.shelf_place.get_idle_count()),
+            "parking_places": (self.parking_place.get_busy_count(), self.parking_place.get_busy_count() + self.parking_place.get_idle_count()),
+            "stations": stations,
+        }
+
+    def get_queue_stats(self):
+        # orders waiting now, and how long the orders given out so far waited
+        return {
+            "queue_depth": len(self.order_queue),
+            "assigned_orders": len(self.queue_times),
+            "mean_time_in_queue": sum(self.queue_times) / len(self.queue_times) if self.queue_times else 0,
+            "max_time_in_queue": max(self.queue_times) if self.queue_times else 0,
+        }
+
     def location_distance(self, location1, location2):
         return fabs(location1.x - location2.x) + fabs(location1.y - location2.y)
     
     def get_nearest_agent(self, target, except_list):
-        temp_distance = float('inf')
-        temp_name = ""
-        
-        for agent_name, agent in self.agent_dict.items():
-            if(agent.is_idle() and agent_name not in except_list):
-                distance = self.location_distance(agent.location, target)
-                if(distance < temp_distance):
-                    temp_distance = self.location_distance(agent.location, target)
-                    temp_name = agent_name
-        if(temp_name == ""):
-            return False
-        return temp_name
+        for agent_name in self.idle_agents.nearest(target, 1 + len(except_list)):
+            if agent_name not in except_list:
+                return agent_name
+        return False
+
+    def get_nearest_agents(self, target, k):
+        # names of the k idle agents nearest to target, nearest first
+        return self.idle_agents.nearest(target, k)
     
     def __str__(self):
         string = ""
@@ -0,0 +1,192 @@
+"""
+
+MAPF Simulator
+
+author: Justin Li (@justin871030)
+
+"""
+
+import sys
+import time
+import heapq
+import itertools
+sys.path.insert(0, './')
+from a_star import FocalAStar
+from cbs import CBS, HighLevelNode, Constraints
+from stats import SearchStats
+
+class ECBS(CBS):
+    """
+    Enhanced CBS: bounded-suboptimal CBS with focal search on both levels.
+
+    The high level expands, among the open nodes whose cost is at most
+    w * (smallest lower bound in the open list), the one with the fewest
+    conflicts. The low level does the same for single paths with FocalAStar,
+    counting conflicts with the other agents' paths of the node. The returned
+    plan costs at most w times the optimal one; the lower bound it proves is
+    kept in lower_bound.
+    """
+    def __init__(self, environment, w = 1.5, max_nodes = None, time_limit = None, windowed = False, hooks = None):
+        CBS.__init__(self, environment, max_nodes = max_nodes, time_limit = time_limit, windowed = windowed, hooks = hooks)
+        self.w = w
+        self.a_star = FocalAStar(self, w)
+        self.lower_bound = 0
+        # paths of the other agents, indexed for count_transition_conflicts
+        self.vertex_occupancy = {} # time -> {location: agents}
+        self.edge_occupancy = {} # time -> {from location: {to location: agents}}
+        self.stay_occupancy = {} # location -> times from which an agent stays there
+
+    def search(self):
+
+        start_time = time.time()
+        self.a_star.deadline = None if self.time_limit is None else start_time + self.time_limit
+        self.expanded_nodes = 0
+        self.low_level_searches = 0
+        self.avoided_low_level_searches = 0
+        self.stats = SearchStats()
+        self.stats.low_level_expansions = self.a_star.expansions
+        counter = itertools.count()
+
+        start = HighLevelNode()
+        for agent in self.env.agent_dict.keys():
+            start.constraint_dict[agent] = Constraints()
+        self.constraint_dict = start.constraint_dict
+        for agent in self.env.agent_dict.keys():
+            local_solution, lower_bound = self.compute_focal_solution(start.solution, agent)
+            if not local_solution:
+                return self.finish_search(start_time, {})
+            start.solution[agent] = local_solution
+            start.agent_lower_bounds[agent] = lower_bound
+        self.evaluate_node(start)
+
+        open_list = [] # every open node, by lower bound
+        pending_list = [] # open nodes outside the focal bound, by cost
+        focal_list = [] # open nodes within the bound, by conflicts then cost
+        bound = self.w * start.lower_bound
+        self.push_node(start, bound, open_list, pending_list, focal_list, counter)
+
+        while True:
+            if self.budget_exhausted(start_time):
+                print("search budget exhausted after " + str(self.expanded_nodes) + " nodes")
+                break
+            while open_list and open_list[0][-1].expanded:
+                heapq.heappop(open_list)
+            if not open_list:
+                break
+            lower_bound = open_list[0][0]
+            if self.w * lower_bound > bound:
+                bound = self.w * lower_bound
+                while pending_list and pending_list[0][0] <= bound:
+                    node = heapq.heappop(pending_list)[-1]
+                    heapq.heappush(focal_list, (node.num_conflicts, node.cost, next(counter), node))
+            if not focal_list:
+                break
+
+            P = heapq.heappop(focal_list)[-1]
+            if P.cost > self.w * lower_bound:
+                # the bound shrank since the node was filed as focal
+                heapq.heappush(pending_list, (P.cost, next(counter), P))
+                bound = self.w * lower_bound
+                continue
+            P.expanded = True
+            self.expanded_nodes += 1
+            if self.hooks:
+                self.call_hook('expand', P)
+
+            self.constraint_dict = P.constraint_dict
+            conflict_dict = self.get_first_conflict(P.solution)
+            if not conflict_dict:
+                self.lower_bound = lower_bound
+                print("solution found")
+                print("cost: " + str(P.cost) + ", lower bound: " + str(lower_bound))
+
+                self.update_path_list(P.solution)
+
+                return self.finish_search(start_time, P.solution, P)
+
+            constraint_dict = self.create_constraints_from_conflict(conflict_dict)
+
+            for agent in constraint_dict.keys():
+                new_node = HighLevelNode()
+                new_node.depth = P.depth + 1
+                new_node.constraint_dict = dict(P.constraint_dict)
+                new_node.constraint_dict[agent] = P.constraint_dict[agent].copy()
+                new_node.constraint_dict[agent].add_constraint(constraint_dict[agent])
+
+                self.constraint_dict = new_node.constraint_dict
+                local_solution, agent_lower_bound = self.compute_focal_solution(P.solution, agent)
+                self.avoided_low_level_searches += len(P.solution) - 1
+                if not local_solution:
+                    continue
+                new_node.solution = dict(P.solution)
+                new_node.solution[agent] = local_solution
+                new_node.agent_lower_bounds = dict(P.agent_lower_bounds)
+                new_node.agent_lower_bounds[agent] = agent_lower_bound
+                self.evaluate_node(new_node)
+                self.push_node(new_node, bound, open_list, pending_list, focal_list, counter)
+
+        for agent in self.env.agent_dict.values():
+            print(agent.location,agent.target)
+
+        return self.finish_search(start_time, {})
+
+    def push_node(self, node, bound, open_list, pending_list, focal_list, counter):
+        heapq.heappush(open_list, (node.lower_bound, next(counter), node))
+        if node.cost <= bound:
+            heapq.heappush(focal_list, (node.num_conflicts, node.cost, next(counter), node))
+        else:
+            heapq.heappush(pending_list, (node.cost, next(counter), node))
+        self.stats.nodes_generated += 1
+        # open_list also keeps expanded nodes until they reach its top
+        if len(focal_list) + len(pending_list) > self.stats.peak_open_size:
+            self.stats.peak_open_size = len(focal_list) + len(pending_list)
+        if self.hooks:
+            self.call_hook('generate', node)
+
+    def evaluate_node(self, node):
+        node.cost = self.compute_solution_cost(node.solution)
+        node.lower_bound = sum(node.agent_lower_bounds.values())
+        node.num_conflicts = self.count_conflicts(node.solution)
+
+    def compute_focal_solution(self, solution, agent):
+        # plan agent around its constraints, avoiding the other paths of solution where it can
+        self.build_occupancy(solution, agent)
+        local_solution = self.compute_agent_solution(agent)
+        # the cost of a path counts its states, one more than the steps f_min bounds
+        return local_solution, self.a_star.last_lower_bound + 1
+
+    def build_occupancy(self, solution, agent):
+        horizon = self.get_conflict_horizon()
+        self.vertex_occupancy = {}
+        self.edge_occupancy = {}
+        self.stay_occupancy = {}
+        for other, path in solution.items():
+            if other == agent:
+                continue
+            length = len(path) if horizon is None else min(len(path), horizon + 1)
+            for i in range(length):
+                locations = self.vertex_occupancy.setdefault(path[i].time, {})
+                locations[path[i].location] = locations.get(path[i].location, 0) + 1
+                if i > 0 and path[i-1].location != path[i].location:
+                    moves = self.edge_occupancy.setdefault(path[i-1].time, {}).setdefault(path[i-1].location, {})
+                    moves[path[i].location] = moves.get(path[i].location, 0) + 1
+            self.stay_occupancy.setdefault(path[-1].location, []).append(path[-1].time)
+
+    def count_transition_conflicts(self, state_1, state_2, agent_name):
+        horizon = self.get_conflict_horizon()
+        if horizon is not None and state_2.time > horizon:
+            return 0
+        count = 0
+        locations = self.vertex_occupancy.get(state_2.time)
+        if locations:
+            count += locations.get(state_2.location, 0)
+        stay_times = self.stay_occupancy.get(state_2.location)
+        if stay_times:
+            count += len([stay_time for stay_time in stay_times if state_2.time > stay_time])
+        if state_1.location != state_2.location:
+            moves = self.edge_occupancy.get(state_1.time)
+            if moves:
+                swaps = moves.get(state_2.location)
+                if swaps:
+                    count += swaps.get(state_1.location, 0)
+        return count
@@ -8,29 +8,35 @@ author: Justin Li (@justin871030)
 
 import sys
 sys.path.insert(0, './')
+from heuristics import DistanceMaps
+from operator import itemgetter
 
 
-class Location:
-    def __init__(self, x=-1, y=-1):
-        self.x = x
-        self.y = y
-    def __eq__(self, other):
-        return self.x == other.x and self.y == other.y
+class Location(tuple):
+    """Immutable grid cell (x, y); tuple-backed, so hashing and equality run in C."""
+    __slots__ = ()
+    def __new__(cls, x=-1, y=-1):
+        return tuple.__new__(cls, (x, y))
+    def __getnewargs__(self):
+        return (self[0], self[1])
+    x = property(itemgetter(0))
+    y = property(itemgetter(1))
     def __str__(self):
-        return str((self.x, self.y))
+        return str((self[0], self[1]))
 
-class State:
-    def __init__(self, time, location):
-        self.time = time
-        self.location = location
-    def __eq__(self, other):
-        return self.time == other.time and self.location == other.location
-    def __hash__(self):
-        return hash(str(self.time)+str(self.location.x) + str(self.location.y))
+class State(tuple):
+    """Immutable (time, location) pair of a path."""
+    __slots__ = ()
+    def __new__(cls, time, location):
+        return tuple.__new__(cls, (time, location))
+    def __getnewargs__(self):
+        return (self[0], self[1])
+    time = property(itemgetter(0))
+    location = property(itemgetter(1))
     def is_equal_except_time(self, state):
-        return self.location == state.location
+        return self[1] == state[1]
     def __str__(self):
-        return str((self.time, self.location.x, self.location.y))
+        return str((self[0], self[1][0], self[1][1]))
     
 class Agent:
     def __init__(self, name, location, target):
@@ -53,6 +59,7 @@ class Agent:
     
     def assign_task(self, task):
         self.task = task
+        self.task.agent_name = self.name
         self.target = self.task.shelf_location
         self.state.state = 1
     
@@ -70,10 +77,12 @@ class Agent:
             "State: (" + str(self.state) + ") "
 
 class Agent_Task:
-    def __init__(self, shelf_location = Location(), station_location = Location(), parking_location = Location()):
+    def __init__(self, shelf_location = Location(), station_location = Location(), parking_location = Location(), agent_name = None):
         self.shelf_location = shelf_location
         self.station_location = station_location
         self.parking_location = parking_location
+        # set when the task is assigned, so a finished task tells whose it was
+        self.agent_name = agent_name
     
 class Agent_State:
     def __init__(self, agent, state = 0, hold_time_cost = 3, wait_time_cost = 3, put_time_cost = 3):
@@ -164,11 +173,14 @@ class Environment:
         self.agent_dict = {}
 
         self.make_agent_dict(agents)
+
+        self.build_grid()
         
     def read_map_by_2d_list(self, map_list = []):
         if not len(map_list):
             self.dimension = [0,0]
             self.obstacles = []
+            self.build_grid()
             return
         self.dimension = [len(map_list[0]), len(map_list)]
         self.obstacles = []
@@ -176,6 +188,50 @@ class Environment:
             for x in range(len(map_list[0])):
                 if (map_list[y][x] == 1):
                     self.obstacles.append((x,y))
+        self.build_grid()
+
+    def build_grid(self):
+        # cells are indexed by y * width + x, grid[cell] is 1 for obstacles
+        width, height = self.dimension[0], self.dimension[1]
+        self.grid = bytearray(width * height)
+        for x, y in self.obstacles:
+            self.grid[y * width + x] = 1
+        self.build_tables()
+
+    def set_grid(self, dimension, grid):
+        # use an existing occupancy grid, e.g. a buffer in shared memory
+        self.dimension = dimension
+        self.grid = grid
+        self.obstacles = [(cell % dimension[0], cell // dimension[0]) for cell in range(len(grid)) if grid[cell]]
+        self.build_tables()
+
+    def build_tables(self):
+        width, height = self.dimension[0], self.dimension[1]
+        # one shared Location per cell, so planners never allocate them
+        self.locations = [Location(cell % width, cell // width) for cell in range(width * height)]
+        # reachable cells of the wait, up, down, left and right actions, in that order
+        self.neighbor_table = []
+        for y in range(height):
+            for x in range(width):
+                cell = y * width + x
+                neighbors = [cell]
+                if y + 1 < height:
+                    neighbors.append(cell + width)
+                if y - 1 >= 0:
+                    neighbors.append(cell - width)
+                if x - 1 >= 0:
+                    neighbors.append(cell - 1)
+                if x + 1 < width:
+                    neighbors.append(cell + 1)
+                self.neighbor_table.append(tuple(neighbors))
+        # true-distance heuristic tables, shared by all agents and planning windows
+        self.distance_maps = DistanceMaps(self)
+
+    def cell_index(self, location):
+        return location.y * self.dimension[0] + location.x
+
+    def is_obstacle(self, location):
+        return self.grid[location.y * self.dimension[0] + location.x] == 1
                     
     def update_one_timestep(self):
         for agent_name, agent in self.agent_dict.items():
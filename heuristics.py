@@ -0,0 +1,75 @@
+"""
+
+MAPF Simulator
+
+author: Justin Li (@justin871030)
+
+"""
+
+from array import array
+from collections import OrderedDict, deque
+from math import fabs
+
+
+class DistanceMaps:
+    """
+    Exact shortest-path distances on the static grid, one BFS map per goal cell.
+
+    Maps are built lazily, kept in an LRU cache of at most capacity goals and
+    shared by every agent and planning window of the environment. Obstacle
+    cells (shelves, stations, parking places) get a distance so they can be
+    used as start or goal, but paths never pass through them.
+    """
+    UNREACHABLE = -1
+
+    def __init__(self, env, capacity = 1024):
+        self.env = env
+        self.capacity = capacity
+        self.maps = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.maps.clear()
+
+    def get_map(self, goal):
+        goal_cell = goal.y * self.env.dimension[0] + goal.x
+        distance_map = self.maps.get(goal_cell)
+        if distance_map is not None:
+            self.maps.move_to_end(goal_cell)
+            self.hits += 1
+            return distance_map
+        self.misses += 1
+        distance_map = self.compute_map(goal_cell)
+        self.maps[goal_cell] = distance_map
+        if self.capacity is not None and len(self.maps) > self.capacity:
+            self.maps.popitem(last = False)
+        return distance_map
+
+    def compute_map(self, goal_cell):
+        grid = self.env.grid
+        neighbor_table = self.env.neighbor_table
+        distance_map = array('i', [DistanceMaps.UNREACHABLE]) * len(grid)
+        distance_map[goal_cell] = 0
+        queue = deque([goal_cell])
+        while queue:
+            cell = queue.popleft()
+            next_distance = distance_map[cell] + 1
+            for next_cell in neighbor_table[cell]:
+                if distance_map[next_cell] != DistanceMaps.UNREACHABLE:
+                    continue
+                distance_map[next_cell] = next_distance
+                if not grid[next_cell]:
+                    queue.append(next_cell)
+        return distance_map
+
+    def precompute(self, locations):
+        for location in locations:
+            self.get_map(location)
+
+    def distance(self, location, goal):
+        distance = self.get_map(goal)[location.y * self.env.dimension[0] + location.x]
+        if distance == DistanceMaps.UNREACHABLE:
+            # only reachable through cells the agent is allowed to enter
+            return fabs(location.x - goal.x) + fabs(location.y - goal.y)
+        return distance
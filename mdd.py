@@ -0,0 +1,82 @@
+"""
+
+MAPF Simulator
+
+author: Justin Li (@justin871030)
+
+"""
+
+import sys
+sys.path.insert(0, './')
+from conflicts import Conflict
+
+class MDD:
+    """
+    Multi-valued decision diagram of an agent: for each timestep, the cells
+    the agent can occupy on some path of exactly depth steps that respects its
+    current constraints. A level with a single cell means every path of that
+    cost passes there, which is what makes a conflict cardinal.
+
+    It is built with the callbacks of the solver (get_location_state,
+    get_neighbors, admissible_heuristic, is_at_goal), so the solver's
+    constraints must be the agent's ones while building.
+    """
+    def __init__(self, solver, agent_name, depth):
+        self.depth = depth
+        self.levels = []
+        self.goal = None
+        self.build(solver, agent_name)
+
+    def build(self, solver, agent_name):
+        start = solver.get_location_state(agent_name)
+        frontier = {start.location: start}
+        levels = [frontier]
+        edges = []
+        # forward: states from which the goal is still reachable in time
+        for step in range(self.depth):
+            remaining = self.depth - step - 1
+            next_frontier = {}
+            level_edges = {}
+            for location, state in frontier.items():
+                for neighbor in solver.get_neighbors(state, agent_name):
+                    if solver.admissible_heuristic(neighbor, agent_name) > remaining:
+                        continue
+                    level_edges.setdefault(location, set()).add(neighbor.location)
+                    next_frontier[neighbor.location] = neighbor
+            levels.append(next_frontier)
+            edges.append(level_edges)
+            frontier = next_frontier
+
+        # backward: keep only the states on a path that ends at the goal
+        kept = {location for location, state in levels[-1].items() if solver.is_at_goal(state, agent_name)}
+        self.levels = [kept]
+        for step in range(self.depth - 1, -1, -1):
+            kept = {location for location, next_locations in edges[step].items() if next_locations & kept}
+            self.levels.append(kept)
+        self.levels.reverse()
+        if len(self.levels[-1]) == 1:
+            self.goal = next(iter(self.levels[-1]))
+
+    def get_single_location(self, time):
+        # the only cell the agent can be at time, None if there are several
+        if time >= self.depth:
+            return self.goal
+        if len(self.levels[time]) == 1:
+            return next(iter(self.levels[time]))
+        return None
+
+def classify_conflict(conflict, mdd_1, mdd_2):
+    # cardinal if the conflict is on a single-cell level of both agents' MDDs
+    if conflict.type == Conflict.VERTEX:
+        cardinal_1 = mdd_1.get_single_location(conflict.time) == conflict.location_1
+        cardinal_2 = mdd_2.get_single_location(conflict.time) == conflict.location_1
+    else:
+        cardinal_1 = mdd_1.get_single_location(conflict.time) == conflict.location_1 \
+            and mdd_1.get_single_location(conflict.time + 1) == conflict.location_2
+        cardinal_2 = mdd_2.get_single_location(conflict.time) == conflict.location_2 \
+            and mdd_2.get_single_location(conflict.time + 1) == conflict.location_1
+    if cardinal_1 and cardinal_2:
+        return Conflict.CARDINAL
+    if cardinal_1 or cardinal_2:
+        return Conflict.SEMI_CARDINAL
+    return Conflict.NON_CARDINAL
@@ -0,0 +1,255 @@
+"""
+
+MAPF Simulator
+
+author: Justin Li (@justin871030)
+
+"""
+
+import sys
+import time
+sys.path.insert(0, './')
+from cbs import CBS, PBS, Constraints
+from stats import SearchStats, Plan
+from environment import Environment, Agent
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory, Value
+from random import Random
+
+# environment and planners of a worker process, built once by init_worker
+worker_env = None
+worker_cbs = None
+worker_grid = None
+worker_search_id = None
+
+def share_grid(env):
+    # copy the occupancy grid into shared memory, workers map it instead of unpickling it
+    grid = shared_memory.SharedMemory(create = True, size = max(1, len(env.grid)))
+    grid.buf[:len(env.grid)] = env.grid
+    return grid
+
+def start_pool(env, workers, search_id = None):
+    # search_id: shared counter, a worker search stops once it no longer holds the id it started with
+    grid = share_grid(env)
+    pool = ProcessPoolExecutor(max_workers = workers, initializer = init_worker,\
+        initargs = (env.dimension, grid.name, env.window_size, env.time_step_per_planning,\
+                    dict(env.distance_maps.maps), search_id))
+    return pool, grid
+
+def close_pool(pool, grid):
+    pool.shutdown(cancel_futures = True)
+    grid.close()
+    grid.unlink()
+
+def init_worker(dimension, grid_name, window_size, time_step_per_planning, distance_maps, search_id = None):
+    # the map is read from shared memory, the heuristic tables are shipped once per worker
+    global worker_env, worker_cbs, worker_grid, worker_search_id
+    worker_search_id = search_id
+    worker_grid = shared_memory.SharedMemory(name = grid_name)
+    worker_env = Environment(window_size = window_size, time_step_per_planning = time_step_per_planning)
+    worker_env.set_grid(dimension, worker_grid.buf[:dimension[0] * dimension[1]])
+    worker_env.distance_maps.maps.update(distance_maps)
+    worker_cbs = CBS(worker_env)
+
+def snapshot_agent(agent):
+    # the part of an agent the planners read, instead of pickling the whole agent
+    return (agent.name, agent.location, agent.target, agent.task, agent.state.state)
+
+def snapshot_agents(agent_dict):
+    return [snapshot_agent(agent) for agent in agent_dict.values()]
+
+def restore_agents(snapshot):
+    agent_dict = {}
+    for name, location, target, task, state in snapshot:
+        agent = Agent(name, location, target)
+        agent.task = task
+        agent.state.state = state
+        agent_dict[name] = agent
+    return agent_dict
+
+def plan_agent(agent_snapshot, constraints, max_time, deadline):
+    # deadline: absolute time.time() of the search in the main process, None for no limit
+    worker_env.agent_dict = restore_agents([agent_snapshot])
+    worker_cbs.a_star.max_time = max_time
+    worker_cbs.a_star.deadline = deadline
+    worker_cbs.constraint_dict = {agent_snapshot[0]: constraints}
+    local_solution = worker_cbs.compute_agent_solution(agent_snapshot[0])
+    return local_solution, worker_cbs.a_star.last_expansions
+
+def chain_priorities(priority_list):
+    # a total order, from high to low, as the priority edges PBS starts from
+    return {priority_list[i]: {priority_list[i-1]} for i in range(1, len(priority_list))}
+
+def run_pbs(snapshot, priority_list, windowed, max_nodes, time_limit, search_id, fallback = True, seed = None, reorders = 0):
+    # without fallback, a random order whose root has no paths is drawn again (from seed) up to reorders times,
+    # instead of falling back to no priorities, which would repeat the search of the first worker
+    worker_env.agent_dict = restore_agents(snapshot)
+    start_time = time.time()
+    random = Random(seed)
+    cancelled = lambda: worker_search_id.value != search_id
+    while True:
+        remaining = None if time_limit is None else max(0, time_limit - (time.time() - start_time))
+        pbs = PBS(worker_env, windowed = windowed, max_nodes = max_nodes, time_limit = remaining)
+        pbs.cancelled = cancelled
+        initial_priorities = chain_priorities(priority_list) if priority_list else None
+        solution = pbs.search_solution(initial_priorities, fallback = fallback)
+        if solution or pbs.stats.nodes_generated or not reorders or cancelled():
+            break
+        reorders -= 1
+        priority_list = list(priority_list)
+        random.shuffle(priority_list)
+    if not solution:
+        return False
+    return solution, pbs.compute_solution_cost(solution), pbs.priority_list, pbs.stats
+
+class ParallelPBS:
+    """
+    Runs several PBS searches at once on a process pool, each starting from a
+    different priority ordering: the first worker starts without priorities
+    (or, with warm_start, from the order of the previous solution), the
+    others from random total orders, drawn again (up to reorders times) when
+    they leave an agent without a path. Returns the first solution found, or
+    with mode 'best' the cheapest one found before time_limit.
+
+    The searches run in other processes, so of the hooks of PBS only
+    'solution'(plan) is called; the stats are those of the winning worker.
+    """
+    def __init__(self, environment, workers = 4, mode = 'first', windowed = False, max_nodes = None,\
+                 time_limit = None, seed = 0, warm_start = False, reorders = 10, hooks = None):
+        self.env = environment
+        self.workers = workers
+        self.mode = mode
+        self.windowed = windowed
+        self.max_nodes = max_nodes
+        self.time_limit = time_limit
+        self.random = Random(seed)
+        # times a worker draws a new random order when its order gives no root
+        self.reorders = reorders
+        # the first worker starts from the order of the previous solution
+        self.warm_start = warm_start
+        self.pool = None
+        self.grid = None
+        # id of the current search, changed to stop the workers still running the last one
+        self.search_id = Value('i', 0)
+        # local solver for the bookkeeping of a found solution
+        self.pbs = PBS(environment, windowed = windowed)
+        self.priority_list = []
+        self.stats = SearchStats()
+        # event -> callback, only 'solution'(plan)
+        self.hooks = hooks or {}
+
+    def close(self):
+        if self.pool is not None:
+            close_pool(self.pool, self.grid)
+            self.pool = None
+
+    def get_priority_lists(self):
+        agents = list(self.env.agent_dict.keys())
+        priority_lists = [self.priority_list if self.warm_start and self.priority_list else None]
+        for _ in range(self.workers - 1):
+            priority_list = list(agents)
+            self.random.shuffle(priority_list)
+            priority_lists.append(priority_list)
+        return priority_lists
+
+    def search(self):
+        if self.pool is None:
+            self.pool, self.grid = start_pool(self.env, self.workers, self.search_id)
+
+        start_time = time.time()
+        snapshot = snapshot_agents(self.env.agent_dict)
+        search_id = self.search_id.value + 1
+        self.search_id.value = search_id
+        futures = []
+        for i, priority_list in enumerate(self.get_priority_lists()):
+            # the first worker may fall back to no priorities, the others draw new random orders instead
+            seed = None if i == 0 else self.random.randrange(1 << 30)
+            futures.append(self.pool.submit(run_pbs, snapshot, priority_list, self.windowed, self.max_nodes, self.time_limit,\
+                                            search_id, i == 0, seed, self.reorders))
+
+        best = False
+        pending = set(futures)
+        while pending:
+            timeout = None
+            if self.time_limit is not None:
+                timeout = max(0, self.time_limit - (time.time() - start_time))
+            done, pending = wait(pending, timeout = timeout, return_when = FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                result = future.result()
+                if result and (not best or result[1] < best[1]):
+                    best = result
+            if best and self.mode == 'first':
+                break
+        # queued searches are dropped, running ones stop at their next node or A* check
+        self.search_id.value = search_id + 1
+        for future in pending:
+            future.cancel()
+
+        if not best:
+            self.stats = SearchStats()
+            self.stats.runtime = time.time() - start_time
+            return Plan({}, self.stats)
+
+        solution, cost, self.priority_list, self.stats = best
+        print("solution found")
+
+        self.pbs.update_path_list(solution)
+
+        # the stats are the ones of the winning worker's search
+        plan = Plan(self.pbs.generate_plan(solution), self.stats)
+        if self.hooks.get('solution'):
+            self.hooks['solution'](plan)
+        return plan
+
+class ParallelCBS(CBS):
+    """
+    CBS whose independent low-level searches run on a process pool: the root
+    paths of all agents, and the replanning of both children of a conflict.
+    Results are gathered in the serial order and A* is deterministic, so the
+    search returns the same plan as CBS.
+    """
+    def __init__(self, environment, workers = 4, max_nodes = None, time_limit = None, windowed = False, heuristic = None,\
+                 warm_start = False, hooks = None):
+        CBS.__init__(self, environment, max_nodes = max_nodes, time_limit = time_limit, windowed = windowed,\
+                     heuristic = heuristic, warm_start = warm_start, hooks = hooks)
+        self.workers = workers
+        self.pool = None
+        self.grid = None
+
+    def close(self):
+        if self.pool is not None:
+            close_pool(self.pool, self.grid)
+            self.pool = None
+
+    def compute_solution(self, solution = None):
+        solution = dict(solution or {})
+        agents = [agent for agent in self.env.agent_dict.keys() if agent not in solution]
+        for agent in agents:
+            self.constraint_dict.setdefault(agent, Constraints())
+        local_solutions = self.compute_agent_solutions([(agent, self.constraint_dict) for agent in agents])
+        if not all(local_solutions):
+            return False
+        solution.update(zip(agents, local_solutions))
+        return solution
+
+    def compute_agent_solutions(self, tasks):
+        if self.pool is None:
+            self.pool, self.grid = start_pool(self.env, self.workers)
+        time_start = time.perf_counter()
+        futures = [self.pool.submit(plan_agent, snapshot_agent(self.env.agent_dict[agent]),\
+                   constraint_dict.setdefault(agent, Constraints()), self.a_star.max_time, self.a_star.deadline)\
+                   for agent, constraint_dict in tasks]
+        local_solutions = []
+        for future in futures:
+            local_solution, expansions = future.result()
+            self.a_star.expansions += expansions
+            local_solutions.append(local_solution)
+        self.low_level_searches += len(tasks)
+        # wall time of the whole batch
+        self.stats.low_level_time += time.perf_counter() - time_start
+        if self.hooks:
+            for (agent, _), local_solution in zip(tasks, local_solutions):
+                self.call_hook('low_level', agent, local_solution)
+        return local_solutions
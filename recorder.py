@@ -0,0 +1,134 @@
+"""
+
+MAPF Simulator
+
+author: Justin Li (@justin871030)
+
+"""
+
+import sys
+import zipfile
+sys.path.insert(0, './')
+import numpy as np
+
+class Trajectory:
+    """
+    A recorded run: the static layout once, and per timestep the position of
+    every agent and the shelf it carries.
+
+    agent_positions is a (T, N, 2) array of x, y; carried is a (T, N) array
+    of shelf indexes, -1 when the agent carries nothing. Carried shelves are
+    drawn at the position of their agent.
+    """
+    def __init__(self, dimension, shelves, stations, parkings, agent_names, agent_positions, carried):
+        self.dimension = [int(dimension[0]), int(dimension[1])]
+        self.shelves = shelves
+        self.stations = stations
+        self.parkings = parkings
+        self.agent_names = list(agent_names)
+        self.agent_positions = agent_positions
+        self.carried = carried
+
+    def __len__(self):
+        return len(self.agent_positions)
+
+    def get_shelf_positions(self, time):
+        shelves = self.shelves.copy()
+        carrying = self.carried[time] >= 0
+        shelves[self.carried[time][carrying]] = self.agent_positions[time][carrying]
+        return shelves
+
+    @staticmethod
+    def load(file_name):
+        # read a file written by TrajectoryRecorder, chunks in the order they were written
+        with np.load(file_name) as data:
+            chunks = sorted([name for name in data.files if name.startswith("agents_")])
+            agent_positions = np.concatenate([data[name] for name in chunks])
+            carried = np.concatenate([data["carried_" + name[len("agents_"):]] for name in chunks])
+            return Trajectory(data["dimension"], data["shelves"], data["stations"], data["parkings"],\
+                              data["agent_names"], agent_positions, carried)
+
+class TrajectoryRecorder:
+    """
+    Records a run into a Trajectory, chunk_size timesteps at a time.
+
+    With a file_name (.npz), every full chunk is appended to the file and
+    dropped from memory, so long runs use a constant amount of memory and
+    the file can be replayed with Trajectory.load. Call close() at the end
+    to write the last chunk.
+    """
+    def __init__(self, env, shelfs, stations, parkings, file_name = None, chunk_size = 256):
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        self.agent_names = list(env.agent_dict.keys())
+        self.shelf_index = {location: i for i, location in enumerate(shelfs)}
+        self.layout = {
+            "dimension": np.array(env.dimension, dtype = np.int32),
+            "shelves": np.array(shelfs, dtype = np.int16).reshape(-1, 2),
+            "stations": np.array([location for station in stations for location in station], dtype = np.int16).reshape(-1, 2),
+            "parkings": np.array(parkings, dtype = np.int16).reshape(-1, 2),
+            "agent_names": np.array(self.agent_names),
+        }
+        self.chunks = [] # (agent_positions, carried) chunks kept in memory
+        self.chunk_count = 0
+        self.length = 0
+        self.new_chunk()
+        if file_name is not None:
+            with zipfile.ZipFile(file_name, "w") as archive:
+                for name, array in self.layout.items():
+                    self.write_array(archive, name, array)
+
+    def new_chunk(self):
+        self.agent_chunk = np.empty((self.chunk_size, len(self.agent_names), 2), dtype = np.int16)
+        self.carried_chunk = np.empty((self.chunk_size, len(self.agent_names)), dtype = np.int16)
+        self.chunk_length = 0
+
+    def record(self, env):
+        row = self.chunk_length
+        for i, agent_name in enumerate(self.agent_names):
+            agent = env.agent_dict[agent_name]
+            self.agent_chunk[row, i] = agent.location
+            # the shelf is on the agent from the pick-up until it is put back
+            if not agent.is_idle() and not agent.state.state == 1 and not agent.state.state == 7:
+                self.carried_chunk[row, i] = self.shelf_index.get(agent.task.shelf_location, -1)
+            else:
+                self.carried_chunk[row, i] = -1
+        self.chunk_length += 1
+        self.length += 1
+        if self.chunk_length == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.chunk_length:
+            return
+        agent_positions = self.agent_chunk[:self.chunk_length]
+        carried = self.carried_chunk[:self.chunk_length]
+        if self.file_name is None:
+            self.chunks.append((agent_positions, carried))
+        else:
+            with zipfile.ZipFile(self.file_name, "a") as archive:
+                self.write_array(archive, "agents_%06d" % self.chunk_count, agent_positions)
+                self.write_array(archive, "carried_%06d" % self.chunk_count, carried)
+        self.chunk_count += 1
+        self.new_chunk()
+
+    def write_array(self, archive, name, array):
+        with archive.open(name + ".npy", "w", force_zip64 = True) as f:
+            np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle = False)
+
+    def close(self):
+        self.flush()
+
+    def __len__(self):
+        return self.length
+
+    def get_trajectory(self):
+        # everything recorded so far, read back from the file when streaming
+        self.flush()
+        if self.file_name is not None:
+            return Trajectory.load(self.file_name)
+        agent_count = len(self.agent_names)
+        agent_positions = np.concatenate([chunk[0] for chunk in self.chunks]) if self.chunks else np.empty((0, agent_count, 2), dtype = np.int16)
+        carried = np.concatenate([chunk[1] for chunk in self.chunks]) if self.chunks else np.empty((0, agent_count), dtype = np.int16)
+        return Trajectory(self.layout["dimension"], self.layout["shelves"], self.layout["stations"],\
+                          self.layout["parkings"], self.agent_names, agent_positions, carried)
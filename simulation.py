@@ -0,0 +1,223 @@
+"""
+
+MAPF Simulator
+
+author: Justin Li (@justin871030)
+
+"""
+
+import sys
+import time
+sys.path.insert(0, './')
+from cbs import CBS, PBS
+from ecbs import ECBS
+from cbsh import get_heuristic
+from environment import Environment, Location, Agent
+from controller import Shelf_Place, Parking_Place, Station, Order, Controller
+from recorder import TrajectoryRecorder
+from copy import deepcopy
+
+import argparse
+
+from random import randint
+
+def time_use(time_list):
+    count = 0 
+    for i in time_list:
+        count += i
+    print("used time: " + str(count) + "s")
+    return
+
+def make_order_list(shelfs, num): #random choose a shelf that a order need
+    list = []
+    for i in range(num):
+        list.append(Order(shelfs[randint(0,len(shelfs)-1)]))
+    return list
+
+def get_default_test_data(order_num = 50):
+    # 0s are the positions that the robot can reach, 1s are the forbidden positions
+    # the stations, shelfs, parking places should all be obstacles
+    map_obstacle_list = [
+        [0,1,1,1,1,1,1,1,1,1,1,1,1,1,1,0,0,0,0],
+        [1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0],
+        [1,0,1,1,1,1,1,1,1,1,1,1,1,1,0,0,0,0,0],
+        [1,0,1,1,1,1,1,1,1,1,1,1,1,1,0,1,1,1,1],
+        [1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,1,1,1,1],
+        [1,0,1,1,0,1,1,0,1,1,0,1,1,0,0,1,1,1,1],
+        [1,0,1,1,0,1,1,0,1,1,0,1,1,0,0,1,1,1,1],
+        [1,0,1,1,0,1,1,0,1,1,0,1,1,0,0,0,0,0,0],
+        [1,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0],   
+        [0,1,1,1,1,1,1,1,1,1,1,1,1,1,1,0,0,0,0] 
+    ]
+    #    0         5         10        15  
+
+    #station_list is a list of stations that each station have a series of positions to place shelfs
+    station_list = [
+        [
+        Location(15,3), Location(15,4), Location(15,5), Location(15,6), Location(16,3), Location(17,3),
+        Location(18,3), Location(16,6), Location(17,6), Location(18,6)
+        ]
+    ]
+
+    #station_list is a list of shelfs' positions where the shelfs are set
+    shelf_list = [
+        Location(2,2), Location(3,2), Location(4,2), Location(5,2), Location(6,2), Location(7,2),
+        Location(8,2), Location(9,2), Location(10,2), Location(11,2), Location(12,2), Location(13,2),
+        Location(2,3), Location(3,3), Location(4,3), Location(5,3), Location(6,3), Location(7,3),
+        Location(8,3), Location(9,3), Location(10,3), Location(11,3), Location(12,3), Location(13,3),
+        Location(2,5), Location(2,6), Location(2,7), Location(3,5), Location(3,6), Location(3,7),
+        Location(5,5), Location(5,6), Location(5,7), Location(6,5), Location(6,6), Location(6,7),
+        Location(8,5), Location(8,6), Location(8,7), Location(9,5), Location(9,6), Location(9,7),
+        Location(11,5), Location(11,6), Location(11,7), Location(12,5), Location(12,6), Location(12,7),
+    ]
+
+    #parking_list is a list of parking places where the robots should "start from" and "back to" during a assignment of the task
+    parking_list = [
+        Location(0,1), Location(0,2), Location(0,3), Location(0,4), Location(0,5), Location(0,6), Location(0,7), Location(0,8)
+    ]
+
+    #agent_list is a list of robots which should be placed at the parking places at start that be set as the default position.
+    agent_list = [
+        Agent("agent0", parking_list[0], parking_list[0]),
+        Agent("agent1", parking_list[1], parking_list[1]),
+        Agent("agent2", parking_list[2], parking_list[2]),
+        Agent("agent3", parking_list[3], parking_list[3]),
+        Agent("agent4", parking_list[4], parking_list[4]),
+        Agent("agent5", parking_list[5], parking_list[5])
+    ]
+
+
+    #agent_list is a list of orders including target shelves
+    order_list = make_order_list(shelf_list, order_num)
+    
+    return map_obstacle_list, station_list, shelf_list, parking_list, agent_list, order_list
+
+def run(env, map_obstacle_list, station_list, shelf_list, parking_list, agent_list, order_list , use_pbs = False,\
+        max_nodes = None, time_limit = None, windowed = False, precompute_heuristics = False, workers = 0,\
+        parallel_mode = 'first', use_ecbs = False, suboptimality = 1.5, cbs_heuristic = 'none',\
+        warm_start = False, interactive = True, record_file = None, assignment = 'greedy', hooks = None):
+    
+    map_time_count_data = []
+    
+    env.read_map_by_2d_list(map_obstacle_list)
+    env.set_agents(deepcopy(agent_list))
+    
+    stations = []
+    for station in station_list:
+        stations.append(Station(deepcopy(station)))
+        
+    controller = Controller(env.agent_dict, Parking_Place(deepcopy(parking_list)), Shelf_Place(deepcopy(shelf_list)), stations,\
+                            assignment = assignment, distance_maps = env.distance_maps)
+    controller.init_parking_places_with_agents()
+    controller.add_orders(order_list, 0)
+
+    # positions of every timestep, streamed to record_file if given
+    recorder = TrajectoryRecorder(env, shelf_list, station_list, parking_list, file_name = record_file)
+
+    if(precompute_heuristics):
+        env.distance_maps.precompute(shelf_list + [location for station in station_list for location in station] + parking_list)
+
+    if(workers > 1):
+        # process pools are only loaded when they are used
+        from parallel import ParallelPBS, ParallelCBS
+
+    if(use_pbs and workers > 1):
+        cbs = ParallelPBS(env, workers = workers, mode = parallel_mode, windowed = windowed, max_nodes = max_nodes,\
+                          time_limit = time_limit, warm_start = warm_start, hooks = hooks)
+    elif(use_ecbs):
+        cbs = ECBS(env, w = suboptimality, max_nodes = max_nodes, time_limit = time_limit, windowed = windowed, hooks = hooks)
+    elif(use_pbs):
+        cbs = PBS(env, windowed = windowed, max_nodes = max_nodes, time_limit = time_limit, warm_start = warm_start,\
+                  hooks = hooks) 
+    elif(workers > 1):
+        cbs = ParallelCBS(env, workers = workers, max_nodes = max_nodes, time_limit = time_limit, windowed = windowed,\
+                          heuristic = get_heuristic(cbs_heuristic), warm_start = warm_start, hooks = hooks)
+    else:
+        cbs = CBS(env, max_nodes = max_nodes, time_limit = time_limit, windowed = windowed,\
+                  heuristic = get_heuristic(cbs_heuristic), warm_start = warm_start, hooks = hooks) 
+
+    time_count = 0
+    
+    recorder.record(env)
+
+    while time_count < env.total_run_time and controller.order_queue:
+        env.assign_tasks(controller.deal_with_orders(time_count))
+        
+        time_start = time.time() #Timecount start
+
+        solution = cbs.search()
+
+        if not solution:
+            print("solution not found")
+            # wait for the user, a headless run just goes on with the old paths
+            if interactive:
+                input()
+
+        # Time count
+        time_end = time.time()
+
+        time_c= time_end - time_start 
+
+        map_time_count_data.append(time_c)
+
+        for i in range(env.time_step_per_planning):
+            env.update_one_timestep()
+            recorder.record(env)
+
+        tasks = env.return_finish_tasks()
+        controller.deal_with_finished_tasks(tasks)
+        
+        time_count += env.time_step_per_planning
+
+    if(workers > 1):
+        cbs.close()
+    recorder.close()
+    print("order queue: " + ", ".join([name + ": " + str(value) for name, value in controller.get_queue_stats().items()]))
+    
+    return recorder, map_time_count_data 
+
+def add_simulation_arguments(parser):
+  # options of the simulation, shared by the headless runner and visualize.py
+  parser.add_argument("--pbs", type=bool, default=False, help="False: CBS, True: PBS")
+  parser.add_argument("--ecbs", type=bool, default=False, help="True: bounded-suboptimal ECBS instead of CBS")
+  parser.add_argument("--suboptimality", type=float, default=1.5, help="ECBS: plans cost at most this factor times the optimal")
+  parser.add_argument("--cbs_heuristic", default='none', help="CBS high-level heuristic, none: cost only, cg: conflict graph, wdg: weighted dependency graph")
+  parser.add_argument("--warm_start", type=bool, default=False, help="True: start each planning window from the paths and priorities of the previous one")
+  parser.add_argument("--windowed", type=bool, default=False, help="True: only resolve conflicts within window_size steps")
+  parser.add_argument("--window_size", type=int, default=15, help="window_size-factor")
+  parser.add_argument("--time_step_per_planning", type=int, default=10, help="time_step_per_planning-factor")
+  parser.add_argument("--total_run_time", type=int, default=50, help="total_run_time-factor")
+  parser.add_argument("--order_num", type=int, default=20, help="order_num-factor")
+  parser.add_argument("--max_nodes", type=int, default=None, help="max high-level nodes expanded per planning window")
+  parser.add_argument("--time_limit", type=float, default=None, help="max seconds spent per planning window")
+  parser.add_argument("--precompute_heuristics", type=bool, default=False, help="True: build distance maps of all shelves, stations and parking places at startup")
+  parser.add_argument("--workers", type=int, default=0, help="worker processes, PBS: priority orderings tried at once, CBS: low-level searches run at once")
+  parser.add_argument("--parallel_mode", default='first', help="first: take the first solution found, best: the cheapest within time_limit")
+  parser.add_argument("--assignment", default='greedy', help="greedy: orders one by one to the nearest idle agent, batch: min-cost assignment on grid distances")
+  parser.add_argument("--record", default=None, help="stream the trajectory of the run to this .npz file, replay it with visualize.py --replay")
+  return parser
+
+def run_from_args(args, interactive = True):
+  map_obstacle_list, station_list, shelf_list, parking_list, agent_list, order_list = get_default_test_data(order_num = args.order_num)
+
+  # see follow 20 steps without collisions and re-plan each 10 sec, search for following 100 sec from start
+  env = Environment(window_size= args.window_size, time_step_per_planning= args.time_step_per_planning, total_run_time= args.total_run_time)
+
+  recorder, map_time_count_data = run(env, map_obstacle_list, station_list, shelf_list, parking_list, agent_list, order_list, use_pbs= args.pbs,\
+                                               max_nodes= args.max_nodes, time_limit= args.time_limit,\
+                                               windowed= args.windowed, precompute_heuristics= args.precompute_heuristics,\
+                                               workers= args.workers, parallel_mode= args.parallel_mode,\
+                                               use_ecbs= args.ecbs, suboptimality= args.suboptimality,\
+                                               cbs_heuristic= args.cbs_heuristic, warm_start= args.warm_start,\
+                                               interactive= interactive, record_file= args.record,\
+                                               assignment= args.assignment)
+  return env, recorder, map_time_count_data
+
+if __name__ == "__main__":
+  # headless run: simulate and report the planning time, nothing is drawn
+  parser = add_simulation_arguments(argparse.ArgumentParser())
+  args = parser.parse_args()
+
+  env, recorder, map_time_count_data = run_from_args(args, interactive = False)
+
+  time_use(map_time_count_data)
@@ -0,0 +1,92 @@
+"""
+
+MAPF Simulator
+
+author: Justin Li (@justin871030)
+
+"""
+
+class GridIndex:
+    """
+    Points of the map, key -> Location, kept in square buckets of
+    bucket_size cells, so add and remove are O(1) and a nearest query only
+    looks at the rings of buckets around its location.
+
+    Distances are Manhattan distances. Ties go to the lowest rank, given at
+    add or else the order of the adds.
+    """
+    def __init__(self, bucket_size = 4):
+        self.bucket_size = bucket_size
+        self.buckets = {}
+        self.locations = {}
+        self.ranks = {}
+        self.count = 0
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, key):
+        return key in self.locations
+
+    def __iter__(self):
+        return iter(self.locations)
+
+    def get_bucket(self, location):
+        return (location.x // self.bucket_size, location.y // self.bucket_size)
+
+    def add(self, key, location, rank = None):
+        if key in self.locations:
+            self.remove(key)
+        self.buckets.setdefault(self.get_bucket(location), {})[key] = location
+        self.locations[key] = location
+        self.ranks[key] = self.count if rank is None else rank
+        self.count += 1
+
+    def remove(self, key):
+        bucket = self.get_bucket(self.locations.pop(key))
+        del self.ranks[key]
+        points = self.buckets[bucket]
+        del points[key]
+        if not points:
+            del self.buckets[bucket]
+
+    def get_ring(self, bucket, radius):
+        # buckets at Chebyshev distance radius from bucket
+        bucket_x, bucket_y = bucket
+        if radius == 0:
+            return [bucket]
+        ring = []
+        for dx in range(-radius, radius + 1):
+            ring.append((bucket_x + dx, bucket_y - radius))
+            ring.append((bucket_x + dx, bucket_y + radius))
+        for dy in range(-radius + 1, radius):
+            ring.append((bucket_x - radius, bucket_y + dy))
+            ring.append((bucket_x + radius, bucket_y + dy))
+        return ring
+
+    def nearest(self, location, k = 1):
+        # keys of the k nearest points, nearest first
+        if not self.locations or k <= 0:
+            return []
+        bucket = self.get_bucket(location)
+        found = []
+        seen = 0
+        radius = 0
+        while True:
+            for ring_bucket in self.get_ring(bucket, radius):
+                points = self.buckets.get(ring_bucket)
+                if not points:
+                    continue
+                seen += len(points)
+                for key, point in points.items():
+                    found.append((abs(point.x - location.x) + abs(point.y - location.y), self.ranks[key], key))
+            if seen == len(self.locations):
+                break
+            # points outside the rings seen so far are more than radius * bucket_size away
+            if len(found) >= k:
+                found.sort()
+                if found[k - 1][0] <= radius * self.bucket_size:
+                    break
+            radius += 1
+        found.sort()
+        return [key for distance, rank, key in found[:k]]
@@ -0,0 +1,45 @@
+"""
+
+MAPF Simulator
+
+author: Justin Li (@justin871030)
+
+"""
+
+class SearchStats:
+    """
+    Counters of one search of a solver. They are plain attributes updated
+    where the solver already does the work, plus two clocks around the
+    low-level searches and the conflict detection, so keeping them on costs
+    a few additions per node.
+
+    nodes_expanded counts expansions, so a CBS node expanded again after a
+    bypass counts twice. constraints is the number of constraints of the
+    solution node for CBS and ECBS, and its number of priority pairs for PBS.
+    """
+    def __init__(self):
+        self.runtime = 0
+        self.nodes_generated = 0
+        self.nodes_expanded = 0
+        self.peak_open_size = 0
+        self.low_level_searches = 0
+        self.low_level_expansions = 0
+        self.low_level_time = 0
+        self.conflict_time = 0
+        self.constraints = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        return ", ".join([name + ": " + str(round(value, 4) if isinstance(value, float) else value)\
+                          for name, value in vars(self).items()])
+
+class Plan(dict):
+    """
+    Result of a search: the plan, agent -> [{'t', 'x', 'y'}], and the stats
+    of the search that produced it. Empty when no solution was found.
+    """
+    def __init__(self, plan = {}, stats = None):
+        dict.__init__(self, plan)
+        self.stats = stats if stats is not None else SearchStats()